@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
 
+# projects where project harvest > baseline harvest; see `get_rp1_arbocs`
+C8_LANDFILL_EXCLUSIONS = ['CAR1217', 'ACR247', 'ACR276']
+
 
 def calculate_allocation(
     data: pd.DataFrame, rp: int = 1, round_intermediates: bool = False
@@ -65,7 +69,7 @@ def get_rp1_arbocs(opr_id, baseline_components, rp_components):
     """
 
     # Equation C.8 of 2015 protocol: if project harvest > baseline harvest, exclude landfill
-    if opr_id in ['CAR1217', 'ACR247', 'ACR276']:
+    if opr_id in C8_LANDFILL_EXCLUSIONS:
         baseline_components['ifm_8'] = 0
         rp_components['ifm_8'] = 0
 
@@ -94,3 +98,50 @@ def get_arbocs(baseline_components, rp_components):
 
     calculated_allocation = delta_onsite + leakage_adjusted_delta_wood_products + secondary_effects
     return calculated_allocation
+
+
+def get_arbocs_matrix(opr_ids, baseline_components, rp_components):
+    """Vectorized `get_rp1_arbocs` over many projects and many scenarios
+
+    Parameters
+    ----------
+    opr_ids : array-like
+        Project IDs, shape (n_projects,)
+    baseline_components : dict
+        Baseline components (ifm_1, ifm_3, ifm_7, ifm_8). Values are either per-project arrays of shape
+        (n_projects,) or per-scenario arrays of shape (n_projects, n_scenarios)
+    rp_components : dict
+        Reporting period components (ifm_1, ifm_3, ifm_7, ifm_8, confidence_deduction,
+        secondary_effects), shaped like `baseline_components`
+
+    Returns
+    -------
+    arbocs : np.ndarray
+        ARBOCs with shape (n_projects, n_scenarios)
+    """
+    opr_ids = np.asarray(opr_ids)
+
+    def as_matrix(values):
+        return np.asarray(values, dtype=float).reshape(len(opr_ids), -1)
+
+    baseline = {k: as_matrix(v) for k, v in baseline_components.items()}
+    rp = {k: as_matrix(v) for k, v in rp_components.items()}
+
+    # Equation C.8 of 2015 protocol: if project harvest > baseline harvest, exclude landfill
+    exclude_landfill = np.isin(opr_ids, C8_LANDFILL_EXCLUSIONS)[:, np.newaxis]
+    baseline['ifm_8'] = np.where(exclude_landfill, 0, baseline['ifm_8'])
+    rp['ifm_8'] = np.where(exclude_landfill, 0, rp['ifm_8'])
+
+    baseline_carbon = baseline['ifm_1'] + baseline['ifm_3']
+    onsite_carbon = rp['ifm_1'] + rp['ifm_3']
+    adjusted_onsite = onsite_carbon * np.round(1 - rp['confidence_deduction'], 5)
+
+    delta_onsite = adjusted_onsite - baseline_carbon
+
+    baseline_wood_products = baseline['ifm_7'] + baseline['ifm_8']
+    actual_wood_products = rp['ifm_7'] + rp['ifm_8']
+    leakage_adjusted_delta_wood_products = (actual_wood_products - baseline_wood_products) * 0.8
+
+    secondary_effects = np.minimum(0, rp['secondary_effects'])  # Never allowed to have positive SE.
+
+    return delta_onsite + leakage_adjusted_delta_wood_products + secondary_effects
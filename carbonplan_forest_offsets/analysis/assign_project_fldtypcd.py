@@ -1,12 +1,28 @@
+import hashlib
+import json
 import math
+from functools import lru_cache
 
 import dask
 import dask.dataframe as dd
-import geopandas
+import fsspec
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
 from sklearn.feature_extraction import DictVectorizer
 
-from ..data import cat
-from ..utils import to_geodataframe
+from ..cache import get_source_fingerprint
+from ..data import cat, get_catalog_urlpath, get_local_cache_dir
+from ..utils import clip_points
+from .regional_classifier import (
+    DEFAULT_RADII,
+    get_distance_weights,
+    prepare_regional_classifier,
+    score_radii,
+)
+
+CLASSIFIER_CACHE_DIR = 'classifiers'
 
 
 def fractional_basal_area_by_species(data):
@@ -29,7 +45,12 @@ def load_cond_classification_data(postal_codes):
     plot_cols = ['CN', 'LAT', 'LON', 'ELEV', 'INVYR']
     cond_ddf = dd.concat(
         [
-            cat.fia(postal_code=postal_code.lower(), table='cond', columns=cond_cols).to_dask()
+            cat.fia(
+                postal_code=postal_code.lower(),
+                table='cond',
+                columns=cond_cols,
+                filters=[('COND_STATUS_CD', '==', 1)],
+            ).to_dask()
             for postal_code in postal_codes
         ],
         ignore_index=True,
@@ -49,7 +70,7 @@ def load_cond_classification_data(postal_codes):
     return conds
 
 
-def load_tree_classification_data(postal_codes):
+def load_live_tree_ddf(postal_codes):
     tree_cols = [
         'CN',
         'PLT_CN',
@@ -62,13 +83,23 @@ def load_tree_classification_data(postal_codes):
 
     trees = dd.concat(
         [
-            cat.fia(postal_code=postal_code, table='tree', columns=tree_cols).to_dask()
+            cat.fia(
+                postal_code=postal_code,
+                table='tree',
+                columns=tree_cols,
+                filters=[('STATUSCD', '==', 1)],
+            ).to_dask()
             for postal_code in postal_codes
         ],
         ignore_index=True,
     )
     trees = trees[trees['STATUSCD'] == 1]  # only looking at live trees
     trees['unadj_basal_area'] = math.pi * (trees['DIA'] / (2 * 12)) ** 2 * trees['TPA_UNADJ']
+    return trees
+
+
+def load_tree_classification_data(postal_codes):
+    trees = load_live_tree_ddf(postal_codes)
     features = trees.groupby(['PLT_CN', 'CONDID']).apply(
         fractional_basal_area_by_species, meta=('fraction_species', 'f4')
     )
@@ -76,16 +107,104 @@ def load_tree_classification_data(postal_codes):
     return features
 
 
-def load_classification_data(postal_codes, target_var='FORTYPCD', aoi=None):
-    tree_features = load_tree_classification_data(postal_codes)
+def get_species_dictvectorizer(spcds):
+    """DictVectorizer over a fixed SPCD vocabulary, for encoding project species fractions"""
+    vec = DictVectorizer()
+    vec.fit([{str(spcd): 1 for spcd in spcds}])
+    return vec
+
+
+def build_species_fraction_matrix(trees, spcds=None):
+    """Sparse (conditions x species) matrix of the fraction of basal area represented by each species
+
+    Equivalent to `fractional_basal_area_by_species` applied per condition, but built directly from
+    integer group codes so no per-condition python objects are created.
+
+    Parameters
+    ----------
+    trees : pd.DataFrame
+        Live trees with PLT_CN, CONDID, SPCD and unadj_basal_area columns
+    spcds : list, optional
+        Fixed SPCD vocabulary; defaults to the species present in `trees`
+
+    Returns
+    -------
+    dict with `features` (scipy.sparse.csr_matrix), `conditions` (pd.MultiIndex of PLT_CN, CONDID,
+    one per row of `features`), `presence` (boolean csr_matrix marking the species that appear in
+    each condition's dict, including ones whose fraction rounds to zero) and `dictvectorizer` (maps
+    species dicts onto the `features` columns)
+    """
+    cond_codes, conditions = pd.MultiIndex.from_arrays(
+        [trees['PLT_CN'].values, trees['CONDID'].values], names=['PLT_CN', 'CONDID']
+    ).factorize()
+
+    if spcds is None:
+        spcds = np.unique(trees['SPCD'].values)
+    vec = get_species_dictvectorizer(spcds)
+
+    # only map the unique species to vocabulary columns, not every tree
+    unique_spcds, spcd_inverse = np.unique(trees['SPCD'].values, return_inverse=True)
+    spcd_columns = np.array([vec.vocabulary_.get(str(spcd), -1) for spcd in unique_spcds])
+    species_codes = spcd_columns[spcd_inverse]
+    in_vocabulary = species_codes >= 0
+
+    basal_area = np.nan_to_num(trees['unadj_basal_area'].values.astype(float))
+    total_basal_area = np.bincount(cond_codes, weights=basal_area, minlength=len(conditions))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = basal_area / total_basal_area[cond_codes]
+
+    features = sparse.coo_matrix(
+        (
+            fraction[in_vocabulary],
+            (cond_codes[in_vocabulary], species_codes[in_vocabulary]),
+        ),
+        shape=(len(conditions), len(vec.vocabulary_)),
+    ).tocsr()  # duplicate (condition, species) entries are summed
+    features.data = np.nan_to_num(features.data).round(4)
+    features.eliminate_zeros()
+
+    # species with a defined fraction, i.e. the keys `fractional_basal_area_by_species` would keep
+    present = in_vocabulary & np.isfinite(fraction)
+    presence = sparse.coo_matrix(
+        (np.ones(present.sum(), dtype=bool), (cond_codes[present], species_codes[present])),
+        shape=features.shape,
+    ).tocsr()
+
+    return {
+        'features': features,
+        'conditions': conditions,
+        'presence': presence,
+        'dictvectorizer': vec,
+    }
+
+
+def load_tree_classification_features(postal_codes, spcds=None):
+    cols = ['PLT_CN', 'CONDID', 'SPCD', 'unadj_basal_area']
+    trees = load_live_tree_ddf(postal_codes)[cols].compute()
+    return build_species_fraction_matrix(trees, spcds=spcds)
+
+
+def load_classification_data(postal_codes, target_var='FORTYPCD', aoi=None, spcds=None):
+    """species fraction features and forest type targets for the conditions used in training
+
+    Unless a fixed `spcds` vocabulary is given, the vocabulary is narrowed to the species present
+    in the retained conditions, as if the DictVectorizer had been fit on those conditions alone.
+    """
+    tree_features = load_tree_classification_features(postal_codes, spcds=spcds)
+    feature_rows = pd.Series(
+        np.arange(len(tree_features['conditions'])),
+        index=tree_features['conditions'],
+        name='feature_row',
+    )
+
     conds = load_cond_classification_data(postal_codes)
     conds = conds[(conds['INVYR'] >= 2002) & (conds['INVYR'] < 2013)]
     if aoi:
-        conds = to_geodataframe(conds)
-        conds = geopandas.clip(conds, aoi)
+        conds = clip_points(conds, aoi)
 
-    data = conds.join(tree_features, on=['PLT_CN', 'CONDID']).dropna(
-        subset=[target_var, 'fraction_species']
+    data = conds.join(feature_rows, on=['PLT_CN', 'CONDID']).dropna(
+        subset=[target_var, 'feature_row']
     )
     data = data.loc[
         (data['FORTYPCD'] != 999)
@@ -99,9 +218,104 @@ def load_classification_data(postal_codes, target_var='FORTYPCD', aoi=None):
     valid_target_classes = target_counts[target_counts > 30].index.unique().tolist()
 
     data = data[data[target_var].isin(valid_target_classes)]
-    data = data.dropna(subset=[target_var, 'fraction_species'])
-    vec = DictVectorizer()
-    X = vec.fit_transform(data["fraction_species"].values)
+    rows = data['feature_row'].astype(int).values
+    X = tree_features['features'][rows]
+    vec = tree_features['dictvectorizer']
+    if spcds is None:
+        support = np.asarray(tree_features['presence'][rows].sum(axis=0)).ravel() > 0
+        X = X[:, np.flatnonzero(support)]
+        vec.restrict(support)
     y = data[target_var].values
 
     return {'features': X, 'targets': y, 'dictvectorizer': vec}
+
+
+@lru_cache(maxsize=64)
+def get_state_fia_fingerprint(postal_code):
+    """remote etag, modification time and size of every file in a state's FIA tables
+
+    Memoized, so the remote listing happens at most once per state and process.
+    """
+    store = {}
+    for table in ['cond', 'plot', 'tree']:
+        urlpath, storage_options = get_catalog_urlpath('fia', postal_code=postal_code, table=table)
+        fs, path = fsspec.core.url_to_fs(urlpath, **storage_options)
+        for fn, info in fs.find(path, detail=True).items():
+            store[fn] = [info.get('etag'), str(info.get('last_modified')), info.get('size')]
+    return store
+
+
+def get_fia_fingerprint(postal_codes):
+    """identify the FIA tables for a set of states by the remote etag, modification time and size"""
+    store = {}
+    for postal_code in sorted(postal_code.lower() for postal_code in postal_codes):
+        store.update(get_state_fia_fingerprint(postal_code))
+    return store
+
+
+def get_classifier_code_fingerprint():
+    """source hashes of the feature encoding and fitting code, so editing it invalidates classifiers"""
+    funcs = [
+        load_classification_data,
+        load_tree_classification_features,
+        build_species_fraction_matrix,
+        get_species_dictvectorizer,
+        prepare_regional_classifier,
+        score_radii,
+        get_distance_weights,
+    ]
+    return [get_source_fingerprint(func) for func in funcs]
+
+
+def get_classifier_fingerprint(postal_codes, aoi=None, target_var='FORTYPCD', radii=DEFAULT_RADII):
+    """hash of everything that determines a fitted regional classifier"""
+    key = {
+        'fia': get_fia_fingerprint(postal_codes),
+        'code': get_classifier_code_fingerprint(),
+        'aoi': aoi.wkb_hex if aoi is not None else None,
+        'target_var': target_var,
+        'radii': np.round(np.asarray(radii, dtype=float), 6).tolist(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_regional_classifier(
+    postal_codes, aoi=None, target_var='FORTYPCD', radii=DEFAULT_RADII, name=None, use_cache=True
+):
+    """fit a regional classifier, or reuse one cached on local disk
+
+    Cache entries hold the fitted classifier, the DictVectorizer and the chosen radius and are keyed
+    by `name` (e.g. the supersection id) plus a fingerprint of the FIA inputs, AOI, radius grid and
+    the source of the feature encoding and fitting code.
+    Changing any of those inputs invalidates the entry; older entries for the same name are removed
+    when a new one is written. With `use_cache=False` the FIA tables are only fingerprinted once the
+    classifier has been fit, to name the new entry.
+    """
+    if name is None:
+        name = '-'.join(sorted(postal_code.lower() for postal_code in postal_codes))
+
+    cache_dir = get_local_cache_dir() / CLASSIFIER_CACHE_DIR
+    cache_dir.mkdir(exist_ok=True)
+
+    def get_cache_fn():
+        fingerprint = get_classifier_fingerprint(
+            postal_codes, aoi=aoi, target_var=target_var, radii=radii
+        )
+        return cache_dir / f'{name}-{fingerprint}.joblib'
+
+    fn = get_cache_fn() if use_cache else None
+    if fn is not None and fn.exists():
+        return joblib.load(fn)
+
+    data = load_classification_data(postal_codes, target_var=target_var, aoi=aoi)
+    result = prepare_regional_classifier(data, radii=radii)
+
+    fn = fn or get_cache_fn()
+    for stale_fn in cache_dir.glob(f'{name}-*.joblib'):
+        # names can contain `-` (e.g. `ca-or`), so only the trailing fingerprint is split off
+        if stale_fn.stem.rsplit('-', 1)[0] == name:
+            stale_fn.unlink()
+    tmp_fn = fn.with_suffix('.tmp')
+    joblib.dump(result, tmp_fn)
+    tmp_fn.rename(fn)
+    return result
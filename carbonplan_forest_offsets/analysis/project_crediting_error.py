@@ -3,10 +3,11 @@ from collections import defaultdict
 
 import dask
 import fsspec
+import numpy as np
 from dask.distributed import Client
 
 from ..analysis import rfia
-from ..analysis.allocation import get_arbocs
+from ..analysis.allocation import get_arbocs, get_arbocs_matrix
 from ..data import cat, get_retro_bucket
 
 
@@ -32,8 +33,83 @@ def get_recalculated_arbocs(project, alternate_cp):
     return alt_arbocs
 
 
+def get_project_components(projects):
+    """struct-of-arrays view of the project data needed to recalculate arbocs"""
+    baseline_keys = ['ifm_1', 'ifm_3', 'ifm_7', 'ifm_8']
+    rp_keys = baseline_keys + ['confidence_deduction', 'secondary_effects']
+    return {
+        'opr_id': np.array([project['opr_id'] for project in projects]),
+        'acreage': np.array([project['acreage'] for project in projects], dtype=float),
+        'slag_to_total_carbon': np.array(
+            [get_slag_to_total_scalar(project) for project in projects], dtype=float
+        ),
+        'baseline': {
+            k: np.array([project['baseline'][k] for project in projects], dtype=float)
+            for k in baseline_keys
+        },
+        'rp_1': {
+            k: np.array([project['rp_1'][k] for project in projects], dtype=float) for k in rp_keys
+        },
+    }
+
+
+def get_recalculated_arbocs_matrix(components, alternate_cp):
+    """vectorized `get_recalculated_arbocs` for a sweep of common practice values
+
+    components: output of `get_project_components`
+    alternate_cp: (n_projects, n_scenarios) grid of alternate common practice values, or a 1-d grid of
+    scenarios shared by every project
+
+    returns a (n_projects, n_scenarios) matrix of arbocs. Unlike `get_recalculated_arbocs`, this applies
+    the C.8 landfill exclusion from `get_rp1_arbocs`.
+    """
+    alt_baseline = dict(components['baseline'])
+    alt_baseline['ifm_1'] = (components['acreage'] * components['slag_to_total_carbon'])[
+        :, np.newaxis
+    ] * np.asarray(alternate_cp, dtype=float)
+
+    return get_arbocs_matrix(components['opr_id'], alt_baseline, components['rp_1'])
+
+
+def get_project_crediting_error_batched(project, fortyp_weights, n_obs=1000):
+    """vectorized version of the crediting error loop
+
+    all `n_obs` alternate SLAG values are drawn at once and converted to alternate ARBOCs with array
+    operations, rather than re-running the rFIA groupbys once per observation
+    """
+    baseline_rfia_slag = rfia.get_rfia_arb_common_practice(project, use_site_class='all')
+
+    alt_slag = rfia.get_project_weighted_slag(
+        project, fortyp_weights, use_site_class='all', uncertainty=True, n_obs=n_obs
+    )
+    scaled_alt_slag = project['carbon']['common_practice']['value'] * alt_slag / baseline_rfia_slag
+
+    # CAR1183 has CP of zero.
+    scaled_alt_slag = np.where(scaled_alt_slag == 0, alt_slag, scaled_alt_slag)
+
+    alt_arbocs = get_recalculated_arbocs(project, scaled_alt_slag)
+    alt_arbocs = np.where(
+        scaled_alt_slag > project['carbon']['initial_carbon_stock']['value'], 0, alt_arbocs
+    )
+
+    delta_arbocs = project['arbocs']['calculated'] - alt_arbocs
+    return {
+        'alt_slag': scaled_alt_slag.tolist(),
+        'alt_arbocs': alt_arbocs.tolist(),
+        'delta_arbocs': delta_arbocs.tolist(),
+    }
+
+
 @dask.delayed(pure=True, traverse=True)
-def get_project_crediting_error(project, fortyp_weights, n_obs=1000):
+def get_project_crediting_error(project, fortyp_weights, n_obs=1000, batched=True):
+    """propagate rFIA uncertainty through to alternate ARBOCs
+
+    batched: draw all `n_obs` realizations at once (see `get_project_crediting_error_batched`)
+    instead of looping one observation at a time
+    """
+    if batched:
+        return get_project_crediting_error_batched(project, fortyp_weights, n_obs=n_obs)
+
     store = defaultdict(list)
     i = 0
 
@@ -84,15 +160,18 @@ if __name__ == '__main__':
     with fsspec.open(fn, mode='r', **fs_kwargs) as f:
         reclassification_weights = json.load(f)
 
+    projects = [project for project in projects if project['opr_id'] in reclassification_weights]
+
+    # workers read the local rFIA summary index, so build whatever it is missing before dispatching
+    supersection_ids = {
+        eval(k)[0] for project in projects for k in reclassification_weights[project['opr_id']]
+    }
+    rfia.ensure_rfia_summary(supersection_ids)
+
     overcrediting = {}
     for project in projects:
         pid = project['opr_id']
-
-        if pid in reclassification_weights:
-            fortyp_weights = reclassification_weights[pid]
-        else:
-            continue
-
+        fortyp_weights = reclassification_weights[pid]
         overcrediting[pid] = get_project_crediting_error(project, fortyp_weights)
 
     overcrediting = dask.compute(overcrediting)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.model_selection import check_cv
+from sklearn.neighbors import NearestNeighbors, RadiusNeighborsClassifier
+
+# initial testing never yielded a case where we went above 0.5
+DEFAULT_RADII = np.arange(0.15, 0.651, 0.025)
+OUTLIER_LABEL = -999
+
+
+def get_distance_weights(row_ids, distances, n_rows):
+    """inverse distance weights, matching `weights='distance'` in sklearn neighbors estimators
+
+    if a sample has any neighbors at zero distance, only those neighbors get (equal) weight
+    """
+    is_zero = distances == 0
+    has_zero = np.bincount(row_ids, weights=is_zero, minlength=n_rows) > 0
+    with np.errstate(divide='ignore'):
+        weights = 1 / distances
+    return np.where(has_zero[row_ids], is_zero.astype(float), weights)
+
+
+def score_radii(X_train, y_train, X_test, y_test, radii, classes, n_jobs=None):
+    """accuracy of a distance weighted RadiusNeighborsClassifier for every radius in `radii`
+
+    Neighbors are searched once, at the largest radius, and every smaller radius is scored by
+    thresholding that cached neighborhood.
+
+    Parameters
+    ----------
+    X_train, X_test : array-like or sparse matrix
+        Features
+    y_train, y_test : np.ndarray
+        Integer codes into `classes`
+    radii : array-like
+        Radii to score
+    classes : np.ndarray
+        Sorted class labels; predictions with no neighbors get `OUTLIER_LABEL`
+
+    Returns
+    -------
+    scores : np.ndarray
+        Accuracy per radius
+    """
+    nn = NearestNeighbors(radius=np.max(radii), algorithm='brute', n_jobs=n_jobs).fit(X_train)
+    distances, indices = nn.radius_neighbors(X_test, return_distance=True)
+
+    n_test = len(y_test)
+    row_ids = np.repeat(np.arange(n_test), [len(idx) for idx in indices])
+    distances = np.concatenate(distances)
+    neighbor_labels = y_train[np.concatenate(indices).astype(int)]
+    truth = classes[y_test]
+
+    scores = []
+    for radius in radii:
+        within = distances <= radius
+        rows = row_ids[within]
+        weights = get_distance_weights(rows, distances[within], n_test)
+        votes = sparse.coo_matrix(
+            (weights, (rows, neighbor_labels[within])), shape=(n_test, len(classes))
+        ).toarray()
+
+        has_neighbors = np.bincount(rows, minlength=n_test) > 0
+        predictions = np.where(has_neighbors, classes[votes.argmax(axis=1)], OUTLIER_LABEL)
+        scores.append(np.mean(predictions == truth))
+    return np.array(scores)
+
+
+def prepare_regional_classifier(data, radii=DEFAULT_RADII, cv=5, n_jobs=None):
+    """select a radius by cross validation and fit a RadiusNeighborsClassifier
+
+    Equivalent to running `GridSearchCV` (accuracy scoring, refit=True) over `radii` with a
+    `RadiusNeighborsClassifier(weights='distance', algorithm='brute', outlier_label=-999)`, but
+    pairwise distances are only computed once per fold.
+
+    Parameters
+    ----------
+    data : dict
+        Output of `load_classification_data`
+    radii : array-like
+        Radius grid to search
+    cv : int or cross-validation generator
+        Passed to `sklearn.model_selection.check_cv`
+
+    Returns
+    -------
+    dict with the refit `classifier`, the chosen `radius`, per-fold `cv_scores` (pd.DataFrame indexed by
+    radius) and the `dictvectorizer` used to encode project species
+    """
+    X, y = data['features'], np.asarray(data['targets'])
+    radii = np.asarray(radii)
+    classes, y_codes = np.unique(y, return_inverse=True)
+
+    cv = check_cv(cv, y, classifier=True)
+    fold_scores = {
+        f'split{i}': score_radii(
+            X[train], y_codes[train], X[test], y_codes[test], radii, classes, n_jobs=n_jobs
+        )
+        for i, (train, test) in enumerate(cv.split(X, y))
+    }
+    cv_scores = pd.DataFrame(fold_scores, index=pd.Index(radii, name='radius'))
+    cv_scores['mean_test_score'] = cv_scores.mean(axis=1)
+
+    radius = radii[cv_scores['mean_test_score'].values.argmax()]
+    classifier = RadiusNeighborsClassifier(
+        radius=radius, weights='distance', algorithm='brute', outlier_label=OUTLIER_LABEL
+    ).fit(X, y)
+
+    return {
+        'classifier': classifier,
+        'radius': radius,
+        'cv_scores': cv_scores,
+        'dictvectorizer': data.get('dictvectorizer'),
+    }
@@ -1,41 +1,107 @@
 # given a classificaiton dict, spit out some common practice values
+import shutil
 from collections import Counter
 from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 
-from ..data import cat
+from ..cache import cached
+from ..data import cat, get_local_cache_dir
 from ..utils import aa_code_to_ss_code
 
+RFIA_STORE_DIR = 'rfia_store'
+RFIA_KEYS = [
+    'YEAR',
+    'FORTYPCD',
+    'site',
+    'CARB_ACRE',
+    'CARB_TOTAL',
+    'AREA_TOTAL',
+    'CARB_ACRE_VAR',
+    'CARB_TOTAL_VAR',
+    'AREA_TOTAL_VAR',
+    'nPlots_TREE',
+    'nPlots_AREA',
+]
+
+
+def fetch_rfia_data(assessment_area_id):
+    '''download both the per site class and the `all` site class rFIA outputs for an assessment area'''
+    data_all = cat.rfia_all(assessment_area_id=int(assessment_area_id)).read()
+    data_all['site'] = 'all'
+
+    data = cat.rfia(assessment_area_id=int(assessment_area_id)).read()
+    data = pd.concat([data_all[RFIA_KEYS], data[RFIA_KEYS]], ignore_index=True)
+    data['assessment_area_id'] = int(assessment_area_id)
+    return data.dropna(subset=['site'])
+
+
+def write_rfia_store(data, path=None):
+    '''write rFIA outputs to a local parquet dataset, partitioned by assessment area and site class'''
+    if path is None:
+        path = get_local_cache_dir() / RFIA_STORE_DIR
+    if path.exists():
+        shutil.rmtree(path)
+    data.to_parquet(path, partition_cols=['assessment_area_id', 'site'], index=False)
+    return path
+
+
+def ingest_rfia_data(assessment_area_ids=None):
+    '''pull every rFIA output into the local rFIA store, replacing per assessment area csv reads'''
+    if assessment_area_ids is None:
+        assessment_area_ids = list(aa_code_to_ss_code().keys())
 
-@lru_cache(maxsize=None)
+    store = []
+    for assessment_area_id in assessment_area_ids:
+        try:
+            store.append(fetch_rfia_data(assessment_area_id))
+        except FileNotFoundError:
+            # rFIA was only run for assessment areas in supersections that contain projects
+            continue
+
+    return write_rfia_store(pd.concat(store, ignore_index=True))
+
+
+def get_rfia_store_fingerprint():
+    '''modification time of the local rFIA store (None without one), to key cached rFIA reads'''
+    store_path = get_local_cache_dir() / RFIA_STORE_DIR
+    return store_path.stat().st_mtime_ns if store_path.exists() else None
+
+
+@cached(fingerprint=get_rfia_store_fingerprint)
 def load_rfia_data(assessment_area_id, site_class='all'):
+    '''load rFIA outputs for an assessment area, preferring the local rFIA store when it exists
 
+    Assessment areas and site classes with no partition in the store (e.g. a partial ingest) are read
+    from the catalog. Ingested ones are always read from the store, even if no rows pass the filters.
+    '''
     valid_site_classes = ['all', 'low', 'high']
     if site_class not in valid_site_classes:
         raise ValueError(f"site class must be in {[x for x in valid_site_classes]}")
 
-    keys = [
-        'YEAR',
-        'FORTYPCD',
-        'site',
-        'CARB_ACRE',
-        'CARB_TOTAL',
-        'AREA_TOTAL',
-        'CARB_ACRE_VAR',
-        'CARB_TOTAL_VAR',
-        'AREA_TOTAL_VAR',
-        'nPlots_TREE',
-        'nPlots_AREA',
-    ]
+    store_path = get_local_cache_dir() / RFIA_STORE_DIR
+    partition = store_path / f'assessment_area_id={int(assessment_area_id)}' / f'site={site_class}'
+    if partition.exists():
+        data = pd.read_parquet(
+            store_path,
+            columns=RFIA_KEYS,
+            filters=[
+                ('assessment_area_id', '=', int(assessment_area_id)),
+                ('site', '=', site_class),
+                ('CARB_TOTAL', '>', 0),
+                ('YEAR', '>=', 2010),
+            ],
+        )
+        data['site'] = data['site'].astype(str)
+        return data
 
     if site_class == 'all':
         data = cat.rfia_all(assessment_area_id=int(assessment_area_id)).read()
         data['site'] = 'all'
-        data = data[keys]
+        data = data[RFIA_KEYS]
     else:
-        data = cat.rfia(assessment_area_id=int(assessment_area_id)).read()[keys]
+        data = cat.rfia(assessment_area_id=int(assessment_area_id)).read()[RFIA_KEYS]
         data = data[data['site'] == site_class]
 
     data = data[data['CARB_TOTAL'] > 0]
@@ -117,50 +183,192 @@ def get_rfia_arb_common_practice(project, use_site_class=None):
     return cp
 
 
-def get_fortyp_weighted_slag_co2e_acre(
-    supersection_id, fortyp_weights, site_class, uncertainty=False
-):
-    '''calculate SLAG (CO2e per acre) within a superseciton, weighting by forest types'''
-    # find all assessment areas per supersection, in the event that classifier doesnt like the aa assignment developer has choosen
-    assessment_area_ids = [
-        aa_id for aa_id, ss_id in aa_code_to_ss_code().items() if ss_id == supersection_id
-    ]
+RFIA_SUMMARY_FN = 'rfia_summary.parquet'
+RFIA_SUMMARY_INDEX = ['ss_id', 'site_class', 'assessment_area_id', 'YEAR', 'FORTYPCD']
+RFIA_SUMMARY_KEYS = ['CARB_ACRE', 'CARB_TOTAL', 'AREA_TOTAL', 'CARB_ACRE_VAR']
 
-    rfia_data = pd.concat(
-        [
-            load_rfia_data(assessment_area_id, site_class=site_class)
-            for assessment_area_id in assessment_area_ids
-        ]
-    )
 
-    common_practice_by_fortyp = (
-        rfia_data.groupby(['YEAR', 'FORTYPCD'])
-        .apply(get_rfia_slag_co2e_acre, (uncertainty))
-        .rename('common_practice')
-        .reset_index(level=['FORTYPCD'])
-    )
+def build_rfia_summary(supersection_ids=None, save=True):
+    '''build the rFIA summary index: one row per (ss_id, site_class, assessment area, YEAR, FORTYPCD)
 
-    df = (
-        common_practice_by_fortyp.groupby('YEAR')
-        .apply(calculate_fortyp_weighted_slag, (fortyp_weights))
-        .rename(columns={0: 'fortyp_cp', 1: 'percent_null'})
+    Rows are kept per assessment area so uncertainty can be drawn per row, as the rFIA outputs are
+    perturbed independently before being combined. The index is persisted to the local cache dir and
+    read back by `load_rfia_summary`. With `supersection_ids`, only those supersections are rebuilt
+    and merged into the existing index.
+    '''
+    aa_to_ss = aa_code_to_ss_code()
+    if supersection_ids is None:
+        supersection_ids = set(aa_to_ss.values())
+
+    store = []
+    for site_class in ['all', 'low', 'high']:
+        for assessment_area_id, ss_id in aa_to_ss.items():
+            if ss_id not in supersection_ids:
+                continue
+            try:
+                data = load_rfia_data(assessment_area_id, site_class=site_class)
+            except FileNotFoundError:
+                # rFIA was only run for assessment areas in supersections that contain projects
+                continue
+            store.append(
+                data.assign(
+                    ss_id=ss_id, site_class=site_class, assessment_area_id=assessment_area_id
+                )
+            )
+
+    columns = RFIA_SUMMARY_INDEX + RFIA_SUMMARY_KEYS
+    summary = (
+        pd.concat(store, ignore_index=True)[columns] if store else pd.DataFrame(columns=columns)
     )
 
-    median_slag = df.loc[(df.index <= 2013) & (df.index >= 2010), 'fortyp_cp'].median()
+    if save:
+        fn = get_local_cache_dir() / RFIA_SUMMARY_FN
+        if fn.exists():
+            existing = pd.read_parquet(fn)
+            existing = existing[~existing['ss_id'].isin(supersection_ids)]
+            summary = pd.concat([existing, summary], ignore_index=True)
+        summary = summary.sort_values(RFIA_SUMMARY_INDEX, ignore_index=True)
+        summary.to_parquet(fn, index=False)
+
+        load_rfia_summary.cache_clear()
+        get_rfia_summary_arrays.cache_clear()
+    return summary
+
 
-    if df.loc[(df.index <= 2013) & (df.index >= 2010), 'percent_null'].max() > 0.2:
-        return np.nan
+def ensure_rfia_summary(supersection_ids):
+    '''build the rFIA summary index for those of `supersection_ids` it does not cover yet
 
-    # if np.isnan(median_slag):
-    #    median_slag = df.loc[(df.index == 2010), 'fortyp_cp'].median()
+    Returns the supersections that were built.
+    '''
+    fn = get_local_cache_dir() / RFIA_SUMMARY_FN
+    present = set(pd.read_parquet(fn, columns=['ss_id'])['ss_id']) if fn.exists() else set()
+    missing = set(supersection_ids) - present
+    if missing:
+        build_rfia_summary(supersection_ids=missing)
+    return missing
 
-    if np.isnan(median_slag):
+
+@lru_cache(maxsize=None)
+def load_rfia_summary():
+    '''load the rFIA summary index written by `build_rfia_summary`'''
+    fn = get_local_cache_dir() / RFIA_SUMMARY_FN
+    if not fn.exists():
+        raise FileNotFoundError(
+            f'no rFIA summary index at {fn}, build it with `build_rfia_summary` first '
+            '(scripts/preprocess/build_rfia_summary.py)'
+        )
+    return pd.read_parquet(fn)
+
+
+@lru_cache(maxsize=None)
+def get_rfia_summary_arrays(supersection_id, site_class):
+    '''columnar slice of the rFIA summary index for a single supersection and site class
+
+    `years`, `year_idx`, `fortypcd`, `carb_total` and `area_total` are pooled over assessment areas
+    per (YEAR, FORTYPCD), for the point estimate. The `row_` arrays keep every assessment area row.
+    '''
+    summary = load_rfia_summary()
+    if not (summary['ss_id'] == supersection_id).any():
+        raise KeyError(
+            f'supersection {supersection_id} is not in the rFIA summary index, '
+            'rebuild it with `build_rfia_summary`'
+        )
+    rows = summary[(summary['ss_id'] == supersection_id) & (summary['site_class'] == site_class)]
+    pooled = rows.groupby(['YEAR', 'FORTYPCD'])[['CARB_TOTAL', 'AREA_TOTAL']].sum().reset_index()
+
+    years, year_idx = np.unique(pooled['YEAR'].values, return_inverse=True)
+    return {
+        'years': years,
+        'year_idx': year_idx,
+        'fortypcd': pooled['FORTYPCD'].values,
+        'carb_total': pooled['CARB_TOTAL'].values,
+        'area_total': pooled['AREA_TOTAL'].values,
+        'row_year_idx': np.searchsorted(years, rows['YEAR'].values),
+        'row_fortypcd': rows['FORTYPCD'].values,
+        'row_carb_acre': rows['CARB_ACRE'].values,
+        'row_carb_acre_var': rows['CARB_ACRE_VAR'].values,
+    }
+
+
+def get_percent_null(year_idx, n_years, weights, fortyp_weights):
+    '''per year, the fraction of fortyp weight that has no matching rFIA estimate'''
+    present = np.bincount(year_idx, weights=np.nan_to_num(weights), minlength=n_years)
+    return sum(fortyp_weights.values()) - present
+
+
+def get_median_fortyp_slag(years, fortyp_cp, percent_null):
+    '''median fortyp weighted SLAG over the 2010-2013 inventories, along the last (year) axis'''
+    in_window = (years <= 2013) & (years >= 2010)
+    if not in_window.any():
         # this only occurs when cross-state evals cannot be matched historically.
-        median_slag = df.loc[(df.index >= 2010), 'fortyp_cp'].median()
-        if df.loc[(df.index >= 2010), 'percent_null'].max() > 0.2:
-            return np.nan
+        in_window = years >= 2010
+
+    if not in_window.any() or percent_null[in_window].max() > 0.2:
+        return np.full(fortyp_cp.shape[:-1], np.nan) if fortyp_cp.ndim > 1 else np.nan
 
-    return median_slag
+    return np.median(fortyp_cp[..., in_window], axis=-1)
+
+
+def get_fortyp_weighted_slag_co2e_acre_samples(
+    supersection_id, fortyp_weights, site_class, n_obs=1000
+):
+    '''draw `n_obs` realizations of fortyp weighted SLAG (CO2e per acre) at once
+
+    As in `get_rfia_slag_co2e_acre(..., uncertainty=True)`, every assessment area row's CARB_ACRE is
+    perturbed independently by its own variance, and the weighted rows are then summed per year.
+    Noise is drawn as a single (n_obs x rows) matrix and reduced with array operations.
+    '''
+    summary = get_rfia_summary_arrays(supersection_id, site_class)
+    years, row_year_idx = summary['years'], summary['row_year_idx']
+
+    year_indicator = np.zeros((len(row_year_idx), len(years)))
+    year_indicator[np.arange(len(row_year_idx)), row_year_idx] = 1
+
+    carbon_uncertainty = np.random.normal(0, 1, [n_obs, len(row_year_idx)]) * (
+        summary['row_carb_acre_var'] ** 0.5
+    )
+    slag = (summary['row_carb_acre'] + carbon_uncertainty) * 44 / 12 * 0.907185
+
+    # nan_to_num mirrors the nansum in `calculate_fortyp_weighted_slag`
+    row_weights = pd.Series(summary['row_fortypcd']).map(fortyp_weights).values
+    fortyp_cp = np.nan_to_num(slag * row_weights) @ year_indicator
+
+    weights = pd.Series(summary['fortypcd']).map(fortyp_weights).values
+    percent_null = get_percent_null(summary['year_idx'], len(years), weights, fortyp_weights)
+
+    return get_median_fortyp_slag(years, fortyp_cp, percent_null)
+
+
+def get_fortyp_weighted_slag_co2e_acre(
+    supersection_id, fortyp_weights, site_class, uncertainty=False, n_obs=None
+):
+    '''calculate SLAG (CO2e per acre) within a superseciton, weighting by forest types
+
+    Weighted SLAG is a gather from the rFIA summary index (see `build_rfia_summary`) followed by a
+    per-year dot product with the forest type weights.
+
+    n_obs: with `uncertainty`, return an array of `n_obs` realizations drawn in a single batch;
+    without it, the point estimate repeated `n_obs` times
+    '''
+    if uncertainty:
+        samples = get_fortyp_weighted_slag_co2e_acre_samples(
+            supersection_id, fortyp_weights, site_class, n_obs=n_obs or 1
+        )
+        return samples if n_obs is not None else samples[0]
+
+    summary = get_rfia_summary_arrays(supersection_id, site_class)
+    years, year_idx = summary['years'], summary['year_idx']
+
+    slag = summary['carb_total'] / summary['area_total'] * 44 / 12 * 0.907185
+    weights = pd.Series(summary['fortypcd']).map(fortyp_weights).values
+
+    fortyp_cp = np.bincount(year_idx, weights=np.nan_to_num(slag * weights), minlength=len(years))
+    percent_null = get_percent_null(year_idx, len(years), weights, fortyp_weights)
+
+    median_cp = get_median_fortyp_slag(years, fortyp_cp, percent_null)
+    if n_obs is not None:
+        return np.full(n_obs, median_cp)
+    return median_cp
 
 
 def contains_999_aa(project):
@@ -177,7 +385,7 @@ def contains_999_aa(project):
 
 
 def get_project_weighted_slag(
-    project, project_classification, use_site_class=None, uncertainty=False
+    project, project_classification, use_site_class=None, uncertainty=False, n_obs=None
 ):
     store = []
     for k, fortyp_probas in project_classification.items():
@@ -194,6 +402,7 @@ def get_project_weighted_slag(
                 project_classification,
                 use_site_class=use_site_class,
                 uncertainty=uncertainty,
+                n_obs=n_obs,
             )
 
         # assessment areas can show up twice -- once for high and once for low site class. so we've got to loop through assessment areas now.
@@ -206,7 +415,11 @@ def get_project_weighted_slag(
 
                 if use_site_class:
                     median_cp = get_fortyp_weighted_slag_co2e_acre(
-                        classification_ss_id, fortyp_probas, use_site_class, uncertainty=uncertainty
+                        classification_ss_id,
+                        fortyp_probas,
+                        use_site_class,
+                        uncertainty=uncertainty,
+                        n_obs=n_obs,
                     )
                 else:
                     median_cp = get_fortyp_weighted_slag_co2e_acre(
@@ -214,19 +427,20 @@ def get_project_weighted_slag(
                         fortyp_probas,
                         assessment_area['site_class'],
                         uncertainty=uncertainty,
+                        n_obs=n_obs,
                     )
 
-                if np.isnan(median_cp):
+                if np.isnan(median_cp).any():
                     print(f'{project["opr_id"]} has issues w classification lookup')
                 weighted_cp = median_cp * assessment_area['acreage'] / project['acreage']
                 # print(assessment_area['code'], median_cp)
                 store.append(weighted_cp)
-    cp = sum(store)
+    cp = sum(store, np.zeros(n_obs) if n_obs is not None else 0)
     return cp
 
 
 def get_project_weighted_slag_no_species(
-    project, project_classification, use_site_class=None, uncertainty=False
+    project, project_classification, use_site_class=None, uncertainty=False, n_obs=None
 ):
     store = []
 
@@ -241,7 +455,11 @@ def get_project_weighted_slag_no_species(
         for assessment_area in psuedo_assessment_areas:
             if use_site_class:
                 median_cp = get_fortyp_weighted_slag_co2e_acre(
-                    classification_ss_id, fortyp_probas, use_site_class, uncertainty=uncertainty
+                    classification_ss_id,
+                    fortyp_probas,
+                    use_site_class,
+                    uncertainty=uncertainty,
+                    n_obs=n_obs,
                 )
             else:
                 median_cp = get_fortyp_weighted_slag_co2e_acre(
@@ -249,6 +467,7 @@ def get_project_weighted_slag_no_species(
                     fortyp_probas,
                     assessment_area['site_class'],
                     uncertainty=uncertainty,
+                    n_obs=n_obs,
                 )
 
             weighted_cp = median_cp * assessment_area['acreage'] / project['acreage']
@@ -256,4 +475,4 @@ def get_project_weighted_slag_no_species(
 
             store.append(weighted_cp)
 
-    return sum(store)
+    return sum(store, np.zeros(n_obs) if n_obs is not None else 0)
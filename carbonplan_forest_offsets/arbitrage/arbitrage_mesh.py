@@ -1,16 +1,15 @@
 #!/usr/bin/env python3
-from functools import lru_cache
-
 import fsspec
 import geopandas
 from carbonplan_data import cat as core_cat
 from shapely.geometry import Point
 
+from ..cache import cached
 from ..data import get_retro_bucket
-from ..load.geometry import load_supersections
+from ..load.geometry import get_supersections
 
 
-@lru_cache(maxsize=None)
+@cached
 def load_conus_mesh(coarsen=2):
     ds = core_cat.grids.conus4k.to_dask()
 
@@ -36,16 +35,19 @@ def load_supersection_mesh(supersection_id):
     return mesh
 
 
+def warm_supersection_mesh_inputs(supersection_ids):
+    '''read the CONUS mesh and supersections once, so later meshes (and forked workers) reuse them'''
+    mesh = load_conus_mesh(coarsen=2)
+    get_supersections(crs=mesh.crs, include_ak=False, fix_typos=True)
+
+
 def create_supersection_mesh(supersection_id, save=False):
     mesh = load_conus_mesh(coarsen=2)
 
     working_crs = mesh.crs
 
-    supersections = (
-        load_supersections(include_ak=False, fix_typos=True)
-        .set_index('SSection')
-        .to_crs(crs=working_crs)
-    )
+    supersections = get_supersections(crs=working_crs, include_ak=False, fix_typos=True)
+    supersections = supersections.set_index('SSection')
 
     supersection = supersections.loc[supersections['ss_id'] == supersection_id]
 
@@ -62,35 +64,6 @@ def create_supersection_mesh(supersection_id, save=False):
 
 
 if __name__ == '__main__':
+    from .runner import run_supersections
 
-    supersections_with_projects = [
-        1,
-        2,
-        4,
-        15,
-        18,
-        22,
-        24,
-        25,
-        32,
-        35,
-        37,
-        38,
-        39,
-        41,
-        42,
-        43,
-        44,
-        55,
-        58,
-        60,
-        69,
-        76,
-        79,
-        86,
-        88,
-        94,
-        95,
-    ]
-    for supersection_id in supersections_with_projects:
-        create_supersection_mesh(supersection_id, save=True)
+    run_supersections('mesh')
@@ -4,111 +4,209 @@ from functools import lru_cache
 import fsspec
 import geopandas
 import numpy as np
-import pandas as pd
+import pyproj
 import rioxarray  # noqa
+import shapely
 import xarray as xr
-from shapely.geometry import Point
+from scipy.interpolate import RegularGridInterpolator
 from sklearn.neighbors import KDTree
 from sklearn.preprocessing import QuantileTransformer
 
+from ..cache import cached
 from ..data import cat, get_retro_bucket
 from ..load.fia import load_fia_common_practice
-from ..load.geometry import get_bordering_supersections, get_overlapping_states, load_supersections
+from ..load.geometry import (
+    get_bordering_aoi,
+    get_overlapping_states,
+    get_prepared_supersection,
+    get_supersections,
+)
+from ..utils import get_nearest_valid_cells
+
+PRISM_CHUNKS = {'x': 1024, 'y': 1024}
+NEIGHBOR_CHUNKSIZE = 1_000
+GRID_RESOLUTION = 101
+FIA_MEASYEAR_FILTERS = (("MEASYEAR", ">", 2001), ("MEASYEAR", "<=", 2013))
 
 
 @lru_cache(maxsize=None)
 def load_prism(region, var):
-    return cat.prism(region=region, var=var).read().squeeze().rename(var)
+    '''lazily open a PRISM normal as a dask backed DataArray; pixels are only read when computed'''
+    return cat.prism(region=region, var=var, chunks=PRISM_CHUNKS).to_dask().squeeze().rename(var)
 
 
-def load_prism_arbitrage(supersection_id):
-    fs_prefix, fs_kwargs = get_retro_bucket()
-    fn = f'{fs_prefix}/arbitrage/prism-supersections/{supersection_id}.json'
-    with fsspec.open(fn, mode='r', **fs_kwargs) as f:
-        mesh = geopandas.read_file(f)
-    return mesh
+def select_window(da, bounds):
+    '''label based `(minx, miny, maxx, maxy)` window of `da`, padded by one pixel on every side'''
+    minx, miny, maxx, maxy = bounds
+    dx, dy = abs(float(da.x[1] - da.x[0])), abs(float(da.y[1] - da.y[0]))
+    xs = slice(minx - dx, maxx + dx)
+    ys = slice(maxy + dy, miny - dy) if da.y[0] > da.y[-1] else slice(miny - dy, maxy + dy)
+    return da.sel(x=xs, y=ys)
 
 
-def get_prism_arbitrage_map(supersection_id):
-    supersections = load_supersections()  # .to_crs(crs)
-    supersection = supersections[supersections["ss_id"] == supersection_id]
+@cached(disk=False)
+def load_prism_window(region, bounds):
+    '''read tmean and ppt for a `(minx, miny, maxx, maxy)` window (in the PRISM CRS) only
 
-    if supersection_id > 200:
-        region = 'ak'
-        postal_codes = ['ak']
-    else:
-        region = 'conus'
-        bordering_supersections = get_bordering_supersections([supersection_id])
-        aoi = bordering_supersections.unary_union
-        postal_codes = get_overlapping_states(aoi)
+    Windows are memoized in the shared loader cache, so a window read by
+    `warm_prism_arbitrage_inputs` is reused by the map of its supersection.
+    '''
+    window = [select_window(load_prism(region, var), bounds) for var in ['tmean', 'ppt']]
+    return xr.merge(window, combine_attrs="override").load()
 
-    tmean = load_prism(region, "tmean")
-    precip = load_prism(region, "ppt")
-    prism = xr.merge([tmean, precip], combine_attrs="override")
 
-    projected_crs = tmean.crs
+def get_supersection_window(supersection_id, crs):
+    '''a supersection (in `crs`) and the `(minx, miny, maxx, maxy)` window its map reads'''
+    supersections = get_supersections(crs=crs)
+    supersection = supersections[supersections["ss_id"] == supersection_id]
+    return supersection, tuple(supersection.total_bounds)
 
-    clipped = prism.rio.clip(supersection.to_crs(tmean.crs).geometry)
 
-    clim_df = clipped.where(clipped > -9999).to_dataframe().dropna().reset_index()
+def get_region_and_states(supersection_id):
+    '''PRISM region and the FIA states (postal codes) whose plots inform a supersection's map'''
+    if supersection_id > 200:
+        return 'ak', ['ak']
+    aoi = get_bordering_aoi(frozenset([supersection_id]))
+    return 'conus', get_overlapping_states(aoi)
 
-    t_transformer = QuantileTransformer(n_quantiles=1_000)
-    p_transformer = QuantileTransformer(n_quantiles=1_000)
 
-    clim_df["tmean_q"] = t_transformer.fit_transform(
-        clim_df["tmean"].values.reshape(-1, 1)
-    ).squeeze()
-    clim_df["ppt_q"] = p_transformer.fit_transform(clim_df["ppt"].values.reshape(-1, 1)).squeeze()
+def load_fia_plots(postal_codes):
+    '''private FIA conditions (no geometry) measured between 2002 and 2013 in some states'''
+    return load_fia_common_practice(
+        postal_codes, geometry=False, filters=FIA_MEASYEAR_FILTERS
+    ).reset_index(drop=True)
 
-    clim_points = [Point(x, y) for x, y in zip(clim_df.x.values, clim_df.y.values)]
-    gdf = geopandas.GeoDataFrame(clim_df[["tmean_q", "ppt_q"]], geometry=clim_points, crs=tmean.crs)
-    climate_kdtree = KDTree(np.stack([gdf.geometry.x.values, gdf.geometry.y.values], axis=1))
 
-    fia_df = load_fia_common_practice(postal_codes)
-    fia_df = fia_df[(fia_df["MEASYEAR"] > 2001) & (fia_df["MEASYEAR"] <= 2013)]
-    fia_df = fia_df.to_crs(gdf.crs)
+def warm_prism_arbitrage_inputs(supersection_ids):
+    '''read the inputs shared by the maps of several supersections into this process' caches
 
-    points = np.array(list(fia_df.geometry.apply(lambda p: (p.x, p.y))))
+    Only the PRISM windows of the supersections are read (see `load_prism_window`), and FIA
+    conditions are read one state at a time (without a thread pool, and without concatenating every
+    state), so later `get_prism_arbitrage_map` calls (including ones in forked workers) reuse them
+    without reading.
+    '''
+    postal_codes = set()
+    for supersection_id in supersection_ids:
+        region, states = get_region_and_states(supersection_id)
+        _, bounds = get_supersection_window(supersection_id, load_prism(region, "tmean").crs)
+        load_prism_window(region, bounds)
+        postal_codes.update(states)
 
-    inds = climate_kdtree.query(points, return_distance=False).squeeze()
+    for postal_code in sorted(postal_codes):
+        load_fia_plots([postal_code])
 
-    fia_clim = pd.concat(
-        [
-            fia_df.reset_index(drop=True),
-            gdf.loc[inds][["tmean_q", "ppt_q"]].reset_index(drop=True),
-        ],
-        axis=1,
-    )
 
-    ss_climate = (
-        clipped.where(clipped["ppt"] > -9999)
-        .where(clipped["tmean"] > -9999)
-        .to_dataframe()
-        .dropna()
-        .reset_index()
+def load_prism_arbitrage(supersection_id):
+    fs_prefix, fs_kwargs = get_retro_bucket()
+    fn = f'{fs_prefix}/arbitrage/prism-supersections/{supersection_id}.json'
+    with fsspec.open(fn, mode='r', **fs_kwargs) as f:
+        mesh = geopandas.read_file(f)
+    return mesh
+
+
+def get_neighbor_mean(tree, points, values, k, chunksize=NEIGHBOR_CHUNKSIZE):
+    '''mean of `values` over the `k` nearest neighbors in `tree` of each point
+
+    Points are queried `chunksize` at a time, so at most a (chunksize x k) index array is held in
+    memory, and each chunk is reduced with a single gather from `values`.
+    '''
+    means = np.empty(len(points), dtype=float)
+    for start in range(0, len(points), chunksize):
+        idx = tree.query(points[start : start + chunksize], k=k, return_distance=False)
+        means[start : start + chunksize] = np.nanmean(values[idx], axis=1)
+    return means
+
+
+def get_gridded_neighbor_mean(
+    tree, points, values, k, resolution=GRID_RESOLUTION, n_check=1_000, chunksize=NEIGHBOR_CHUNKSIZE
+):
+    '''approximate `get_neighbor_mean` for points in the unit (quantile) square
+
+    The neighbor mean is evaluated once on a `resolution` x `resolution` grid over [0, 1]^2 and
+    bilinearly interpolated onto `points`, so the cost no longer scales with the number of points.
+    The approximation error is measured against the exact neighbor mean at `n_check` random points.
+
+    Returns the interpolated means and a dict with the mean and max absolute error.
+    '''
+    axis = np.linspace(0, 1, resolution)
+    nodes = np.stack(np.meshgrid(axis, axis, indexing='ij'), axis=-1).reshape(-1, 2)
+    grid = get_neighbor_mean(tree, nodes, values, k, chunksize=chunksize)
+    interpolator = RegularGridInterpolator((axis, axis), grid.reshape(resolution, resolution))
+    means = interpolator(np.clip(points, 0, 1))
+
+    rng = np.random.default_rng(0)
+    check = rng.choice(len(points), size=min(n_check, len(points)), replace=False)
+    exact = get_neighbor_mean(tree, points[check], values, k, chunksize=chunksize)
+    abs_error = np.abs(means[check] - exact)
+    error = {'mean_abs_error': float(abs_error.mean()), 'max_abs_error': float(abs_error.max())}
+    return means, error
+
+
+def get_prism_arbitrage_map(supersection_id, chunksize=NEIGHBOR_CHUNKSIZE, grid_resolution=None):
+    '''chunksize: number of PRISM pixels per neighbor-mean query (see `get_neighbor_mean`)
+    grid_resolution: if set, evaluate neighbor-mean SLAG on a quantile grid of this resolution and
+    interpolate it onto the pixels (see `get_gridded_neighbor_mean`); the approximation error is
+    kept in `attrs['grid_error']` of the result
+    '''
+    region, postal_codes = get_region_and_states(supersection_id)
+    projected_crs = load_prism(region, "tmean").crs
+
+    # supersections are reprojected once per CRS and reused across supersections; only the
+    # supersection's bounding box is read from the (lazily opened) PRISM grids
+    supersection, bounds = get_supersection_window(supersection_id, projected_crs)
+    prism = load_prism_window(region, bounds)
+    clipped = prism.rio.clip(supersection.geometry)
+    tmean = clipped["tmean"].values
+    ppt = clipped["ppt"].values
+    valid = (tmean > -9999) & (ppt > -9999)  # NaN (clipped) compares False
+
+    pixel_x = clipped["x"].values[np.nonzero(valid)[1]]
+    pixel_y = clipped["y"].values[np.nonzero(valid)[0]]
+    ss_climate = geopandas.GeoDataFrame(
+        data={"y": pixel_y, "x": pixel_x, "tmean": tmean[valid], "ppt": ppt[valid]},
+        geometry=geopandas.points_from_xy(pixel_x, pixel_y),
+        crs=projected_crs,
     )
 
-    ss_points = [Point(x, y) for x, y in zip(ss_climate.x.values, ss_climate.y.values)]
-    ss_climate = geopandas.GeoDataFrame(data=ss_climate, geometry=ss_points, crs=prism.crs)
+    t_transformer = QuantileTransformer(n_quantiles=1_000)
+    p_transformer = QuantileTransformer(n_quantiles=1_000)
 
-    ss_climate["tmean_q"] = t_transformer.transform(
+    ss_climate["tmean_q"] = t_transformer.fit_transform(
         ss_climate["tmean"].values.reshape(-1, 1)
     ).squeeze()
-    ss_climate["ppt_q"] = p_transformer.transform(ss_climate["ppt"].values.reshape(-1, 1)).squeeze()
+    ss_climate["ppt_q"] = p_transformer.fit_transform(
+        ss_climate["ppt"].values.reshape(-1, 1)
+    ).squeeze()
 
-    fia_tree = KDTree(np.stack([fia_clim.tmean_q.values, fia_clim.ppt_q.values], axis=1))
+    fia_clim = load_fia_plots(postal_codes)
+    x, y = pyproj.Transformer.from_crs("epsg:4326", projected_crs, always_xy=True).transform(
+        fia_clim["LON"].values, fia_clim["LAT"].values
+    )
 
-    mesh_sample_points = np.array(list(ss_climate.apply(lambda x: (x.tmean_q, x.ppt_q), axis=1)))
+    # sample the climate of the (nearest valid) PRISM cell under each plot straight from the grid
+    rows, cols = get_nearest_valid_cells(valid, clipped.rio.transform(), x, y)
+    fia_clim["tmean_q"] = t_transformer.transform(tmean[rows, cols].reshape(-1, 1)).squeeze()
+    fia_clim["ppt_q"] = p_transformer.transform(ppt[rows, cols].reshape(-1, 1)).squeeze()
 
-    fia_idx = fia_tree.query(
-        mesh_sample_points, k=math.floor(0.1 * len(fia_clim)), return_distance=False
-    )
+    fia_tree = KDTree(fia_clim[["tmean_q", "ppt_q"]].values)
 
-    mean_slag = [fia_clim.loc[idx, "slag_co2e_acre"].mean() for idx in fia_idx]
-    ss_climate["mean_local_slag"] = mean_slag
+    neighbor_mean_args = (
+        fia_tree,
+        ss_climate[["tmean_q", "ppt_q"]].values,
+        fia_clim["slag_co2e_acre"].values,
+        math.floor(0.1 * len(fia_clim)),
+    )
+    if grid_resolution:
+        ss_climate["mean_local_slag"], grid_error = get_gridded_neighbor_mean(
+            *neighbor_mean_args, resolution=grid_resolution, chunksize=chunksize
+        )
+        ss_climate.attrs['grid_error'] = grid_error
+    else:
+        ss_climate["mean_local_slag"] = get_neighbor_mean(*neighbor_mean_args, chunksize=chunksize)
 
     # clip FIA back down to just the supersection in question; lookup can span outside -- arbitrage cannot
-    clipped_fia = geopandas.clip(fia_clim, supersection.to_crs(projected_crs))
+    geom = get_prepared_supersection(supersection_id, crs=projected_crs)
+    clipped_fia = fia_clim[shapely.intersects_xy(geom, x, y)]
 
     ss_climate["delta_slag"] = ss_climate["mean_local_slag"] - clipped_fia["slag_co2e_acre"].mean()
     ss_climate["relative_slag"] = (
@@ -118,43 +216,7 @@ def get_prism_arbitrage_map(supersection_id):
 
 
 if __name__ == '__main__':
-    print("creating all relevant arbitrage maps")
-    supersections_with_projects = [
-        1,
-        2,
-        4,
-        15,
-        18,
-        22,
-        24,
-        25,
-        32,
-        35,
-        37,
-        38,
-        39,
-        41,
-        42,
-        43,
-        44,
-        55,
-        58,
-        60,
-        69,
-        76,
-        79,
-        86,
-        88,
-        94,
-        95,
-        286,
-        287,
-    ]
-    fs_prefix, fs_kwargs = get_retro_bucket()
+    from .runner import run_supersections
 
-    for supersection_id in supersections_with_projects:
-        arbitrage_map = get_prism_arbitrage_map(supersection_id)
-
-        fn = f'{fs_prefix}/arbitrage/prism-supersections/{supersection_id}.json'
-        with fsspec.open(fn, mode='w', **fs_kwargs) as f:
-            f.write(arbitrage_map.to_crs('epsg:4326').to_json())
+    print("creating all relevant arbitrage maps")
+    run_supersections('map')
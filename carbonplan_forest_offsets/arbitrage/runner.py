@@ -0,0 +1,183 @@
+import argparse
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import dask
+import fsspec
+
+from ..data import get_retro_bucket
+
+SUPERSECTIONS_WITH_PROJECTS = [
+    1,
+    2,
+    4,
+    15,
+    18,
+    22,
+    24,
+    25,
+    32,
+    35,
+    37,
+    38,
+    39,
+    41,
+    42,
+    43,
+    44,
+    55,
+    58,
+    60,
+    69,
+    76,
+    79,
+    86,
+    88,
+    94,
+    95,
+    286,
+    287,
+]
+
+OUTPUT_DIRS = {'map': 'prism-supersections', 'mesh': 'base_meshes'}
+BACKENDS = ['process', 'dask']
+
+
+def get_default_supersections(kind):
+    '''arbitrage maps cover the alaskan supersections (ss_id > 200) too, base meshes are conus only'''
+    if kind == 'mesh':
+        return [ss_id for ss_id in SUPERSECTIONS_WITH_PROJECTS if ss_id < 200]
+    return SUPERSECTIONS_WITH_PROJECTS
+
+
+def get_output_path(kind, supersection_id):
+    fs_prefix, fs_kwargs = get_retro_bucket()
+    return f'{fs_prefix}/arbitrage/{OUTPUT_DIRS[kind]}/{supersection_id}.json', fs_kwargs
+
+
+def output_exists(kind, supersection_id):
+    fn, fs_kwargs = get_output_path(kind, supersection_id)
+    fs, path = fsspec.core.url_to_fs(fn, **fs_kwargs)
+    return fs.exists(path)
+
+
+def warm_inputs(kind, supersection_ids):
+    # imported per kind; meshes need carbonplan_data, maps don't. Inputs are read with dask's
+    # synchronous scheduler, so no thread pool is left running when the workers are forked
+    with dask.config.set(scheduler='synchronous'):
+        if kind == 'map':
+            from .prism_arbitrage import warm_prism_arbitrage_inputs
+
+            warm_prism_arbitrage_inputs(supersection_ids)
+        else:
+            from .arbitrage_mesh import warm_supersection_mesh_inputs
+
+            warm_supersection_mesh_inputs(supersection_ids)
+
+
+def build_output(kind, supersection_id):
+    if kind == 'map':
+        from .prism_arbitrage import get_prism_arbitrage_map
+
+        return get_prism_arbitrage_map(supersection_id).to_crs('epsg:4326')
+
+    from .arbitrage_mesh import create_supersection_mesh
+
+    return create_supersection_mesh(supersection_id).to_crs('wgs84')
+
+
+def write_output(kind, supersection_id, gdf):
+    '''write `gdf` as geojson through a temporary file, so a partial write is never resumed from'''
+    fn, fs_kwargs = get_output_path(kind, supersection_id)
+    tmp_fn = f'{fn}.tmp'
+    with fsspec.open(tmp_fn, mode='w', **fs_kwargs) as f:
+        f.write(gdf.to_json())
+    fs, _ = fsspec.core.url_to_fs(fn, **fs_kwargs)
+    fs.mv(tmp_fn, fn)
+    return fn
+
+
+def run_supersection(kind, supersection_id):
+    '''build and write the output for one supersection; returns `(supersection_id, fn, traceback)`'''
+    try:
+        fn = write_output(kind, supersection_id, build_output(kind, supersection_id))
+    except Exception:
+        return supersection_id, None, traceback.format_exc()
+    print(f'{kind} {supersection_id}: wrote {fn}')
+    return supersection_id, fn, None
+
+
+def run_supersections(
+    kind,
+    supersection_ids=None,
+    backend='process',
+    max_workers=None,
+    scheduler='processes',
+    overwrite=False,
+):
+    '''build arbitrage maps (`kind='map'`) or base meshes (`kind='mesh'`) for many supersections
+
+    Supersections whose output already exists are skipped unless `overwrite`, so an interrupted
+    run resumes where it stopped. The read-only inputs (PRISM windows, FIA conditions, the CONUS mesh
+    and supersection geometries) are read once, in this process, before any worker starts. Workers
+    are forked from it and share those inputs copy-on-write instead of re-reading them. The inputs
+    are read without leaving threads running, since forking a process with live thread pools (e.g.
+    dask's) can deadlock the workers.
+
+    backend: `process` (a forked process pool) or `dask` (`dask.compute` with `scheduler`; with a
+    distributed scheduler each worker reads the inputs once into its own caches instead)
+    max_workers: defaults to one worker per cpu; 1 builds every supersection in this process
+    Returns `{supersection_id: output path}` for the supersections built in this run.
+    '''
+    if kind not in OUTPUT_DIRS:
+        raise ValueError(f'kind must be one of {list(OUTPUT_DIRS)}, got {kind}')
+    if backend not in BACKENDS:
+        raise ValueError(f'backend must be one of {BACKENDS}, got {backend}')
+
+    if supersection_ids is None:
+        supersection_ids = get_default_supersections(kind)
+    todo = [ss_id for ss_id in supersection_ids if overwrite or not output_exists(kind, ss_id)]
+    skipped = len(supersection_ids) - len(todo)
+    print(f'{kind}: {len(todo)} supersections to build, {skipped} already present')
+    if not todo:
+        return {}
+
+    warm_inputs(kind, todo)
+
+    max_workers = min(max_workers or multiprocessing.cpu_count(), len(todo))
+    if max_workers == 1:
+        results = [run_supersection(kind, ss_id) for ss_id in todo]
+    elif backend == 'process':
+        mp_context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            results = list(executor.map(run_supersection, [kind] * len(todo), todo))
+    else:
+        tasks = [dask.delayed(run_supersection, pure=False)(kind, ss_id) for ss_id in todo]
+        with dask.config.set({'multiprocessing.context': 'fork'}):
+            results = dask.compute(*tasks, scheduler=scheduler, num_workers=max_workers)
+
+    failed = {ss_id: error for ss_id, _, error in results if error is not None}
+    if failed:
+        # the supersections that did finish are kept; rerunning only retries the failed ones
+        errors = '\n'.join(f'supersection {ss_id}:\n{error}' for ss_id, error in failed.items())
+        raise RuntimeError(f'{kind} failed for supersections {list(failed)}\n{errors}')
+    return {ss_id: fn for ss_id, fn, _ in results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", choices=list(OUTPUT_DIRS))
+    parser.add_argument("supersection_ids", nargs="*", type=int)
+    parser.add_argument("--backend", choices=BACKENDS, default='process')
+    parser.add_argument("-j", "--max-workers", type=int)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    run_supersections(
+        args.kind,
+        supersection_ids=args.supersection_ids or None,
+        backend=args.backend,
+        max_workers=args.max_workers,
+        overwrite=args.overwrite,
+    )
@@ -0,0 +1,266 @@
+import functools
+import hashlib
+import inspect
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+
+import geopandas
+import numpy as np
+import pandas as pd
+import shapely
+
+from .data import get_local_cache_dir
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "disk_hits", "misses", "evictions", "nbytes"])
+
+DEFAULT_MAX_BYTES = 4 * 2**30
+DISK_CACHE_DIR = "loaders"
+
+
+GEOMETRY_OVERHEAD_BYTES = 100  # per GEOS geometry, on top of 16 bytes per (x, y) coordinate
+
+
+def get_geometry_nbytes(geometries):
+    """estimate of the memory held by shapely geometries, which pandas counts as 8 byte pointers"""
+    geometries = np.asarray(geometries, dtype=object)
+    n_coords = shapely.get_num_coordinates(geometries).sum()
+    return int(16 * n_coords + GEOMETRY_OVERHEAD_BYTES * len(geometries))
+
+
+def get_nbytes(value):
+    """best effort estimate of the in-memory size of a loader result"""
+    if isinstance(value, pd.DataFrame):
+        nbytes = int(value.memory_usage(deep=True).sum())
+        for column in value.columns[value.dtypes == "geometry"]:
+            nbytes += get_geometry_nbytes(value[column].values)
+        return nbytes
+    if isinstance(value, geopandas.GeoSeries):
+        return int(value.memory_usage(deep=True)) + get_geometry_nbytes(value.values)
+    if isinstance(value, shapely.Geometry):
+        return get_geometry_nbytes([value])
+    if isinstance(value, shapely.STRtree):
+        return get_geometry_nbytes(value.geometries)
+    return int(getattr(value, "nbytes", 0))
+
+
+def normalize_argument(value):
+    """canonical form of a loader argument, so equal calls share one cache key
+
+    Integral floats become ints (`1.0` and `1` are the same assessment area), numpy scalars become
+    python scalars and lists become tuples.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_argument(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((normalize_argument(v) for v in value), key=repr))
+    if isinstance(value, dict):
+        return tuple(sorted(((k, normalize_argument(v)) for k, v in value.items()), key=repr))
+    return value
+
+
+def get_source_fingerprint(func):
+    """hash of a function's source, so cached results are invalidated when the loader changes"""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__code__.co_code.hex()
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def write_to_disk(value, path):
+    """write `value` to `path` (without suffix); returns False for types with no on-disk format"""
+    if isinstance(value, geopandas.GeoDataFrame):
+        fn = path.with_suffix(".geoparquet")
+        value.to_parquet(fn)
+    elif isinstance(value, pd.DataFrame):
+        fn = path.with_suffix(".parquet")
+        value.to_parquet(fn)
+    elif hasattr(value, "to_dataset"):
+        # xarray.DataArray
+        fn = path.with_suffix(".zarr")
+        value.to_dataset(name=value.name or "data").to_zarr(fn, mode="w")
+    else:
+        return False
+    return True
+
+
+def read_from_disk(path):
+    """read a value written by `write_to_disk`; returns None if nothing has been written"""
+    if path.with_suffix(".geoparquet").exists():
+        return geopandas.read_parquet(path.with_suffix(".geoparquet"))
+    if path.with_suffix(".parquet").exists():
+        return pd.read_parquet(path.with_suffix(".parquet"))
+    if path.with_suffix(".zarr").exists():
+        import xarray as xr
+
+        ds = xr.open_zarr(path.with_suffix(".zarr")).load()
+        return ds[list(ds.data_vars)[0]]
+    return None
+
+
+class LoaderCache:
+    """process wide LRU cache with a memory budget and an on-disk tier that survives restarts
+
+    Results are written through to the local cache dir when they are computed. When the in-memory
+    results exceed `max_bytes`, the least recently used ones are evicted from memory and re-read from
+    disk on their next use.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.stats = defaultdict(Counter)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks = defaultdict(threading.Lock)
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def info(self, name):
+        stats = self.stats[name]
+        nbytes = sum(nbytes for (n, _), (_, nbytes) in self._entries.items() if n == name)
+        return CacheInfo(
+            stats["hits"],
+            stats["disk_hits"],
+            stats["misses"],
+            stats["evictions"],
+            nbytes,
+        )
+
+    def key_lock(self, name, token):
+        """lock held while a result is loaded, so concurrent misses for one key load it once"""
+        with self._lock:
+            return self._key_locks[(name, token)]
+
+    def get_disk_path(self, name, token):
+        return get_local_cache_dir() / DISK_CACHE_DIR / name / token
+
+    def get(self, name, token, disk=True):
+        with self._lock:
+            if (name, token) in self._entries:
+                self._entries.move_to_end((name, token))
+                self.stats[name]["hits"] += 1
+                return True, self._entries[(name, token)][0]
+
+        value = read_from_disk(self.get_disk_path(name, token)) if disk else None
+        with self._lock:
+            if value is None:
+                self.stats[name]["misses"] += 1
+                return False, None
+            self.stats[name]["disk_hits"] += 1
+        self.put(name, token, value)
+        return True, value
+
+    def put(self, name, token, value, disk=False):
+        if disk:
+            path = self.get_disk_path(name, token)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                write_to_disk(value, path)
+            except Exception:
+                # not every result serializes (e.g. mixed-type object columns); keep it in memory only
+                for fn in path.parent.glob(f"{token}.*"):
+                    if fn.is_dir():
+                        shutil.rmtree(fn)
+                    else:
+                        fn.unlink()
+
+        nbytes = get_nbytes(value)
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            self._entries[(name, token)] = (value, nbytes)
+            self._entries.move_to_end((name, token))
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            while self._entries and self.nbytes > self.max_bytes:
+                (name, _), _ = self._entries.popitem(last=False)
+                self.stats[name]["evictions"] += 1
+
+    def clear(self, name=None, disk=False):
+        with self._lock:
+            for key in [key for key in self._entries if name is None or key[0] == name]:
+                del self._entries[key]
+            if name is None:
+                self.stats.clear()
+            else:
+                self.stats.pop(name, None)
+
+        if disk:
+            path = get_local_cache_dir() / DISK_CACHE_DIR
+            if name is not None:
+                path = path / name
+            if path.exists():
+                shutil.rmtree(path)
+
+
+loader_cache = LoaderCache(
+    max_bytes=int(os.environ.get("FOREST_OFFSETS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+)
+
+
+def set_memory_budget(max_bytes):
+    """set the shared in-memory budget (in bytes) for cached loaders, evicting if needed"""
+    loader_cache.max_bytes = max_bytes
+    loader_cache.evict()
+
+
+def cache_stats():
+    """hit, disk hit, miss and eviction counters for every cached loader"""
+    return {name: loader_cache.info(name) for name in list(loader_cache.stats)}
+
+
+def cached(func=None, disk=True, version=None, fingerprint=None):
+    """bounded replacement for `lru_cache(maxsize=None)` on data loaders
+
+    All decorated loaders share `loader_cache`, so their combined in-memory footprint stays under one
+    budget (`FOREST_OFFSETS_CACHE_MAX_BYTES`, or `set_memory_budget`). With `disk=True`, results are
+    also persisted (parquet for DataFrames, zarr for DataArrays) under the local cache dir.
+
+    Results are keyed by the bound (defaults applied, normalized) arguments, a hash of the loader's
+    source and `version`, so changing a loader never serves results of its old code. `fingerprint`,
+    a function of no arguments identifying the input data (e.g. a store's modification time), is
+    added to the key on every call so results are also invalidated when their inputs change.
+    """
+    if func is None:
+        return functools.partial(cached, disk=disk, version=version, fingerprint=fingerprint)
+
+    name = f"{func.__module__}.{func.__qualname__}"
+    signature = inspect.signature(func)
+    source_fingerprint = get_source_fingerprint(func)
+
+    def get_token(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (
+            source_fingerprint,
+            version,
+            fingerprint() if fingerprint is not None else None,
+            tuple((k, normalize_argument(v)) for k, v in bound.arguments.items()),
+        )
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = get_token(args, kwargs)
+        with loader_cache.key_lock(name, token):
+            found, value = loader_cache.get(name, token, disk=disk)
+            if found:
+                return value
+
+            value = func(*args, **kwargs)
+            loader_cache.put(name, token, value, disk=disk)
+            return value
+
+    wrapper.cache_info = lambda: loader_cache.info(name)
+    wrapper.cache_clear = lambda disk=False: loader_cache.clear(name, disk=disk)
+    return wrapper
@@ -2,6 +2,7 @@ import os
 import pathlib
 
 import fsspec
+import jinja2
 from intake import open_catalog
 
 cat_dir = pathlib.Path(__file__)
@@ -9,6 +10,14 @@ cat_file = str(cat_dir.parent / "catalog.yaml")
 cat = open_catalog(cat_file)
 
 
+def get_catalog_urlpath(name, **params):
+    '''urlpath and storage options of catalog entry `name`, rendered with its user parameters'''
+    description = cat[name].describe()
+    defaults = {param['name']: param.get('default') for param in description['user_parameters']}
+    urlpath = jinja2.Template(description['args']['urlpath']).render(**{**defaults, **params})
+    return urlpath, description['args'].get('storage_options', {})
+
+
 def get_temp_bucket():
     prefix = 'az://carbonplan-scratch'
     kwargs = {'account_name': 'carbonplan', 'account_key': os.environ.get('BLOB_ACCOUNT_KEY', None)}
@@ -21,6 +30,18 @@ def get_retro_bucket():
     return prefix, kwargs
 
 
+def get_local_cache_dir():
+    '''local directory for derived data products; override with `FOREST_OFFSETS_CACHE_DIR`'''
+    path = pathlib.Path(
+        os.environ.get(
+            'FOREST_OFFSETS_CACHE_DIR',
+            pathlib.Path.home() / '.cache' / 'carbonplan_forest_offsets',
+        )
+    )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 def get_filesystem():
     fs = fsspec.get_filesystem_class('az')(
         account_name='carbonplan', account_key=os.environ['BLOB_ACCOUNT_KEY']
@@ -1,39 +1,152 @@
 import math
-from functools import lru_cache
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
+import dask.dataframe as dd
+import fsspec
 import pandas as pd
 
-from ..data import cat
-from ..utils import to_geodataframe
+from ..cache import cached
+from ..data import cat, get_local_cache_dir
+from ..utils import apply_filters, compact_dtypes, to_geodataframe
 
+REGIONAL_BIOMASS_DIR = 'fia_regional_biomass'
+REGIONAL_BIOMASS_COLUMNS = ['TRE_CN', 'STATECD', 'REGIONAL_DRYBIOT']
+PNW_STATECDS = {'ak': 2, 'ca': 6, 'or': 41, 'wa': 53}
 
-def load_fia_common_practice(postal_codes, private_only=True):
+FIA_TREE_COLUMNS = ['CN', 'PLT_CN', 'TPA_UNADJ', 'SPCD', 'STATUSCD', 'DIA', 'CARBON_AG', 'CONDID']
+FIA_TREE_PLOT_COLUMNS = ['LAT', 'LON', 'ELEV', 'INVYR']
+FIA_TREE_COND_COLUMNS = ['CN_cond', 'OWNCD', 'FORTYPCD', 'FLDTYPCD']
+
+
+def load_fia_common_practice(
+    postal_codes,
+    private_only=True,
+    geometry=True,
+    filters=None,
+    max_workers=None,
+    pool='thread',
+    compact=False,
+):
+    '''load fia-long conditions for one or more states
+
+    geometry: if False, return a plain DataFrame and leave point geometries to be built (e.g. with
+    `utils.as_geodataframe`) only when a spatial operation needs them
+    filters: `(column, op, value)` row filters pushed into the parquet reader,
+    e.g. `[('MEASYEAR', '>', 2001), ('MEASYEAR', '<=', 2013)]`
+    max_workers: number of states loaded concurrently, defaults to one worker per state
+    pool: `thread` or `process`; threads share `load_fia_state_long`'s cache, processes only help
+    when reads are cpu bound (e.g. uncached, local parquet)
+    compact: if True, load each state with compact dtypes (see `utils.compact_dtypes`); the memory
+    saved over all states is kept in `attrs['nbytes_saved']`
+    '''
     if isinstance(postal_codes, str):
         postal_codes = [postal_codes]
+    if pool not in ['thread', 'process']:
+        raise ValueError(f'pool must be thread or process, got {pool}')
 
+    if filters is not None:
+        filters = tuple(tuple(f) for f in filters)  # hashable for load_fia_state_long's cache
+
+    load = partial(
+        load_fia_state_long,
+        private_only=private_only,
+        geometry=False,
+        filters=filters,
+        compact=compact,
+    )
     try:
-        df = pd.concat(
-            [
-                load_fia_state_long(postal_code, private_only=private_only)
-                for postal_code in postal_codes
-            ],
-            ignore_index=True,
-        )
+        if len(postal_codes) == 1:
+            states = [load(postal_codes[0])]
+        else:
+            executor = ThreadPoolExecutor if pool == 'thread' else ProcessPoolExecutor
+            with executor(max_workers=max_workers or len(postal_codes)) as pool_executor:
+                states = list(pool_executor.map(load, postal_codes))
+
+        # a single concat of every state allocates the output once
+        df = pd.concat(states, ignore_index=True)
+        if compact:
+            # concat drops the per-state attrs, so the saving is measured against the uncompacted
+            # states (their index is replaced by a RangeIndex, so it is left out)
+            nbytes = sum(
+                int(state.memory_usage(index=False, deep=True).sum())
+                + state.attrs.get('nbytes_saved', 0)
+                for state in states
+            )
+            # concat falls back to object for categoricals whose categories differ between states
+            df = compact_dtypes(df)
+            df.attrs['nbytes_saved'] = nbytes - int(df.memory_usage(index=False, deep=True).sum())
+        if geometry:
+            df = to_geodataframe(df)
         return df
 
     except:
         raise
 
 
-@lru_cache(maxsize=None)
+def split_regional_biomass(urlpath=None, path=None, chunksize=1_000_000):
+    '''stream the national TREE_REGIONAL_BIOMASS csv once, writing one parquet partition per STATECD
+
+    Only `chunksize` rows are held in memory at a time; each chunk appends one part file to every
+    state it touches, so the result can be read back one state at a time with
+    `load_regional_biomass`.
+    '''
+    if urlpath is None:
+        urlpath = cat.fia_regional_biomass.urlpath
+    if path is None:
+        path = get_local_cache_dir() / REGIONAL_BIOMASS_DIR
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+
+    with fsspec.open(urlpath, mode='r') as f:
+        reader = pd.read_csv(f, usecols=REGIONAL_BIOMASS_COLUMNS, chunksize=chunksize)
+        for i, chunk in enumerate(reader):
+            for statecd, group in chunk.groupby('STATECD'):
+                partition = tmp_path / f'STATECD={int(statecd)}'
+                partition.mkdir(parents=True, exist_ok=True)
+                group[['TRE_CN', 'REGIONAL_DRYBIOT']].to_parquet(
+                    partition / f'part-{i:05d}.parquet', index=False
+                )
+
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+    return path
+
+
+def load_regional_biomass(postal_code, path=None, chunksize=1_000_000):
+    '''load TREE_REGIONAL_BIOMASS rows for one PNW state
+
+    Reads that state's partition written by `split_regional_biomass` when it exists; otherwise
+    streams the national csv and keeps only the matching rows.
+    '''
+    statecd = PNW_STATECDS[postal_code]
+    if path is None:
+        path = get_local_cache_dir() / REGIONAL_BIOMASS_DIR
+
+    if path.exists():
+        partition = path / f'STATECD={statecd}'
+        if not partition.exists():
+            return pd.DataFrame(columns=['TRE_CN', 'REGIONAL_DRYBIOT'])
+        return pd.read_parquet(partition)
+
+    with fsspec.open(cat.fia_regional_biomass.urlpath, mode='r') as f:
+        reader = pd.read_csv(f, usecols=REGIONAL_BIOMASS_COLUMNS, chunksize=chunksize)
+        chunks = [chunk.loc[chunk['STATECD'] == statecd] for chunk in reader]
+    return pd.concat(chunks, ignore_index=True)[['TRE_CN', 'REGIONAL_DRYBIOT']]
+
+
+@cached
 def load_pnw_slag_data(postal_code):
     """PNW states use different allometric equations from the national FIA database.
     This function loads a fresh batch of data for those 4 states.
     In practice, it looks like only AK uses these updated biomass values
     """
-    pnw_states = ['ak', 'or', 'ca', 'wa']
-    if postal_code not in pnw_states:
-        raise NotImplementedError(f"Provide postal code for PNW state: {[x for x in pnw_states]}")
+    if postal_code not in PNW_STATECDS:
+        raise NotImplementedError(f"Provide postal code for PNW state: {[x for x in PNW_STATECDS]}")
 
     tree = cat.fia(
         postal_code=postal_code,
@@ -65,13 +178,9 @@ def load_pnw_slag_data(postal_code):
         columns=['CN', 'PLOT_STATUS_CD', 'MEASYEAR', 'LAT', 'LON', 'ECOSUBCD', 'ELEV'],
     ).read()
 
-    regional_biomass = cat.fia_regional_biomass(
-        csv_kwargs=dict(usecols=['TRE_CN', 'STATECD', 'REGIONAL_DRYBIOT'])
-    ).read()
+    regional_biomass = load_regional_biomass(postal_code)
 
-    regional_tree = tree.join(
-        regional_biomass[['TRE_CN', 'REGIONAL_DRYBIOT']].set_index('TRE_CN'), on=['CN']
-    )
+    regional_tree = tree.join(regional_biomass.set_index('TRE_CN'), on=['CN'])
 
     # regional starts as biomass, so just TPADJ and convert to ha; this is solely to align with FIA-long from carbonplan_forest/preprocess/fia
     regional_tree['unadj_reg_biomass_ha'] = (
@@ -95,9 +204,16 @@ def load_pnw_slag_data(postal_code):
     return full.reset_index()
 
 
-@lru_cache(maxsize=None)
-def load_fia_state_long(postal_code, private_only=True):
-    '''helper function to pre-process the fia-long table'''
+@cached
+def load_fia_state_long(postal_code, private_only=True, geometry=True, filters=None, compact=False):
+    '''helper function to pre-process the fia-long table
+
+    geometry: if False, skip building point geometries and return a plain DataFrame
+    filters: tuple of `(column, op, value)` row filters pushed into the parquet reader; the private
+    ownership filter is pushed down the same way
+    compact: if True, downcast codes, strings and measurements (see `utils.compact_dtypes`); the
+    memory saved is kept in `attrs['nbytes_saved']`
+    '''
     columns = [
         'adj_ag_biomass',
         'OWNCD',
@@ -117,12 +233,17 @@ def load_fia_state_long(postal_code, private_only=True):
         'LON',
         'ELEV',
     ]
+    filters = list(filters or [])
+    if private_only:
+        filters.append(('OWNCD', '==', 46))
+
     if postal_code == 'ak':
         df = load_pnw_slag_data(postal_code)
         df = df[columns]
     else:
-        df = cat.fia_long(postal_code=postal_code, columns=columns).read()
+        df = cat.fia_long(postal_code=postal_code, columns=columns, filters=filters or None).read()
 
+    df = apply_filters(df, filters)
     df = df.dropna(subset=['LAT', 'LON', 'adj_ag_biomass'])
 
     # 44/12 gets us to CO2.
@@ -130,17 +251,23 @@ def load_fia_state_long(postal_code, private_only=True):
     df['slag_co2e_acre'] = df['adj_ag_biomass'] * (44 / 12) * (1 / 2.47) * 0.5
     df['postal_code'] = postal_code
 
-    if private_only:
-        df = df[df['OWNCD'] == 46]
+    if compact:
+        df = compact_dtypes(df)
 
     # add in geometry for later spatial aggregations
-    df = to_geodataframe(df)
+    if geometry:
+        df = to_geodataframe(df)
 
     return df
 
 
-def load_fia_tree(postal_code):
-    '''helper function to pre-process the fia-tree table'''
+def load_fia_tree(postal_code, geometry=True, compact=False):
+    '''helper function to pre-process the fia-tree table
+
+    geometry: if False, skip building point geometries and return a plain DataFrame
+    compact: if True, downcast codes and measurements (see `utils.compact_dtypes`); the memory
+    saved is kept in `attrs['nbytes_saved']`
+    '''
 
     cond_df = cat.fia(
         postal_code=postal_code,
@@ -156,6 +283,7 @@ def load_fia_tree(postal_code):
     tree_df = cat.fia(
         postal_code=postal_code,
         table='tree',
+        filters=[('STATUSCD', '==', 1)],
         columns=[
             'CN',
             'PLT_CN',
@@ -172,6 +300,65 @@ def load_fia_tree(postal_code):
     tree_df['unadj_basal_area'] = math.pi * (tree_df['DIA'] / (2 * 12)) ** 2 * tree_df['TPA_UNADJ']
     tree_df = tree_df.join(plot_df.set_index(['CN']), on='PLT_CN', how='inner')
     tree_df = tree_df.join(cond_agg, rsuffix='_cond', on=['PLT_CN', 'CONDID'])
-    tree_df = to_geodataframe(tree_df)
+    if compact:
+        tree_df = compact_dtypes(tree_df)
+    if geometry:
+        tree_df = to_geodataframe(tree_df)
 
     return tree_df
+
+
+def load_fia_state_tree_ddf(postal_code, columns):
+    tree_columns = [c for c in FIA_TREE_COLUMNS if c in columns or c in ['PLT_CN', 'CONDID']]
+    if 'unadj_basal_area' in columns:
+        tree_columns += [c for c in ['DIA', 'TPA_UNADJ'] if c not in tree_columns]
+    plot_columns = [c for c in FIA_TREE_PLOT_COLUMNS if c in columns]
+    cond_columns = [c for c in FIA_TREE_COND_COLUMNS if c in columns]
+
+    trees = cat.fia(
+        postal_code=postal_code,
+        table='tree',
+        filters=[('STATUSCD', '==', 1)],
+        columns=list(dict.fromkeys(tree_columns + ['STATUSCD'])),
+    ).to_dask()
+    trees = trees[trees['STATUSCD'] == 1]  # only looking at live trees
+    if 'unadj_basal_area' in columns:
+        trees['unadj_basal_area'] = math.pi * (trees['DIA'] / (2 * 12)) ** 2 * trees['TPA_UNADJ']
+
+    # the inner join drops trees without a plot record, so it runs even when no plot column is kept
+    plots = cat.fia(postal_code=postal_code, table='plot', columns=['CN'] + plot_columns).to_dask()
+    trees = trees.merge(plots.rename(columns={'CN': 'PLT_CN'}), on='PLT_CN', how='inner')
+
+    if cond_columns:
+        conds = cat.fia(
+            postal_code=postal_code,
+            table='cond',
+            columns=['PLT_CN', 'CONDID'] + [c.replace('_cond', '') for c in cond_columns],
+        ).to_dask()
+        conds = conds.rename(columns={'CN': 'CN_cond'})
+        conds = conds.groupby(['PLT_CN', 'CONDID']).max().reset_index()
+        trees = trees.merge(conds, on=['PLT_CN', 'CONDID'], how='left')
+
+    return trees[columns]
+
+
+def load_fia_tree_ddf(postal_codes, columns=None):
+    '''lazy, partitioned version of `load_fia_tree` over one or more states
+
+    Builds the live-tree filter, basal-area computation and plot/condition joins as a dask graph, one
+    state at a time, so nothing is materialized until the caller computes (or persists) the result.
+    columns: output columns to keep; only the source columns needed to produce them are read, and the
+    condition table is skipped entirely when no condition column is requested. Defaults to every
+    column `load_fia_tree` returns (with the condition CN as `CN_cond`).
+    '''
+    if isinstance(postal_codes, str):
+        postal_codes = [postal_codes]
+    if columns is None:
+        columns = (
+            FIA_TREE_COLUMNS + ['unadj_basal_area'] + FIA_TREE_PLOT_COLUMNS + FIA_TREE_COND_COLUMNS
+        )
+
+    return dd.concat(
+        [load_fia_state_tree_ddf(postal_code, list(columns)) for postal_code in postal_codes],
+        ignore_index=True,
+    )
@@ -1,11 +1,28 @@
-from functools import lru_cache
+import hashlib
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
+import geopandas
+import numpy as np
 import pandas as pd
-from shapely.ops import cascaded_union
+import pyproj
+import requests
+import shapely
+from shapely import STRtree
+from shapely.ops import unary_union
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-from ..data import cat
-from ..utils import supersection_str_to_ss_code
+from ..cache import cached
+from ..data import cat, get_local_cache_dir
+from ..utils import aa_code_to_ss_code, supersection_str_to_ss_code
+
+SUPERSECTION_ADJACENCY_FN = 'supersection_adjacency-{fingerprint}.json'
+SUPERSECTION_STATES_FN = 'supersection_states-{fingerprint}.json'
+PROJECT_GEOMETRY_CACHE_DIR = 'project_geometries'
+BORDER_BUFFER = 0.01  # degrees
 
 
 @retry(wait=wait_fixed(2), stop=stop_after_attempt(5))
@@ -13,6 +30,92 @@ def load_project_geometry(opr_id):
     return cat.arb_geometries(opr_id=opr_id).read()
 
 
+class ProjectGeometryCache:
+    '''content-addressed local store of project geometries, revalidated against the server ETag
+
+    Responses are stored once per sha256 of their content under `objects/`; `index.json` maps each
+    url to its last ETag and content hash.
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_local_cache_dir() / PROJECT_GEOMETRY_CACHE_DIR
+        self.path = path
+        (self.path / 'objects').mkdir(parents=True, exist_ok=True)
+        self.index_fn = self.path / 'index.json'
+        self.index = json.loads(self.index_fn.read_text()) if self.index_fn.exists() else {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        '''cached `(etag, content)` for `url`, or `(None, None)`'''
+        entry = self.index.get(url)
+        if entry is None:
+            return None, None
+        fn = self.path / 'objects' / f"{entry['sha256']}.json"
+        if not fn.exists():
+            return None, None
+        return entry['etag'], fn.read_bytes()
+
+    def put(self, url, etag, content):
+        sha256 = hashlib.sha256(content).hexdigest()
+        fn = self.path / 'objects' / f'{sha256}.json'
+        if not fn.exists():
+            tmp_fn = fn.with_name(f'{fn.name}.{threading.get_ident()}.tmp')
+            tmp_fn.write_bytes(content)
+            tmp_fn.replace(fn)
+        with self._lock:
+            self.index[url] = {'etag': etag, 'sha256': sha256}
+
+    def save(self):
+        with self._lock:
+            tmp_fn = self.index_fn.with_suffix('.tmp')
+            tmp_fn.write_text(json.dumps(self.index))
+            tmp_fn.replace(self.index_fn)
+
+
+@retry(wait=wait_fixed(2), stop=stop_after_attempt(5))
+def fetch_project_geometry(session, url, cache=None):
+    '''GET a project geometry, sending the cached ETag so unchanged geometries come back as a 304'''
+    etag, content = cache.get(url) if cache is not None else (None, None)
+    headers = {'If-None-Match': etag} if etag else {}
+
+    r = session.get(url, headers=headers, timeout=60)
+    if r.status_code == 304 and content is not None:
+        return content
+    r.raise_for_status()
+    if cache is not None:
+        cache.put(url, r.headers.get('ETag'), r.content)
+    return r.content
+
+
+def load_project_geometries(opr_ids, max_workers=16, use_cache=True):
+    '''load many project geometries concurrently, returning a dict of opr_id to GeoDataFrame
+
+    Requests run in a thread pool that shares one pooled HTTP session, so the total time is close
+    to that of the slowest request. With `use_cache`, geometries are kept in a content-addressed
+    local cache and only re-downloaded when their ETag changes.
+    '''
+    opr_ids = list(opr_ids)
+    urls = {opr_id: cat.arb_geometries(opr_id=opr_id).urlpath for opr_id in opr_ids}
+    cache = ProjectGeometryCache() if use_cache else None
+
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        def load(opr_id):
+            content = fetch_project_geometry(session, urls[opr_id], cache=cache)
+            return geopandas.read_file(io.BytesIO(content))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            geometries = dict(zip(opr_ids, executor.map(load, opr_ids)))
+
+    if cache is not None:
+        cache.save()
+    return geometries
+
+
 def load_ak_supersections():
     '''load alaska assessment areas and rearrange so can append to CONUS supersections'''
     gdf = cat.ak_assessment_areas.read()
@@ -31,7 +134,7 @@ def load_ak_supersections():
     return gdf.to_crs('epsg:4326')
 
 
-@lru_cache(maxsize=None)
+@cached
 def load_supersections(include_ak=True, fix_typos=True):
     str_to_code = supersection_str_to_ss_code()
 
@@ -62,22 +165,188 @@ def load_supersections(include_ak=True, fix_typos=True):
     return gdf
 
 
-@lru_cache(maxsize=None)
+@cached
 def load_states():
     states = cat.states.read()
     states = states[states['postal'] != 'DC']  # never want to consider DC
     return states
 
 
+def get_crs_wkt(crs):
+    '''normalize a CRS (epsg string, pyproj or rasterio CRS, wkt) to wkt, used as a cache key'''
+    return pyproj.CRS.from_user_input(crs).to_wkt()
+
+
+@cached(disk=False)
+def reproject_supersections(crs_wkt, include_ak=True, fix_typos=True):
+    return load_supersections(include_ak=include_ak, fix_typos=fix_typos).to_crs(crs_wkt)
+
+
+@cached(disk=False)
+def reproject_states(crs_wkt):
+    return load_states().to_crs(crs_wkt)
+
+
+@cached(disk=False)
+def reproject_project_geometry(opr_id, crs_wkt):
+    return load_project_geometry(opr_id).to_crs(crs_wkt)
+
+
+def get_supersections(crs=None, include_ak=True, fix_typos=True):
+    '''supersections in `crs`; reprojected copies are memoized per target CRS, so treat as read-only'''
+    if crs is None:
+        return load_supersections(include_ak=include_ak, fix_typos=fix_typos)
+    return reproject_supersections(get_crs_wkt(crs), include_ak=include_ak, fix_typos=fix_typos)
+
+
+def get_states(crs=None):
+    '''states in `crs`; reprojected copies are memoized per target CRS, so treat as read-only'''
+    if crs is None:
+        return load_states()
+    return reproject_states(get_crs_wkt(crs))
+
+
+def get_project_geometry(opr_id, crs=None):
+    '''project geometry in `crs`; reprojected copies are memoized per project and target CRS'''
+    if crs is None:
+        return load_project_geometry(opr_id)
+    return reproject_project_geometry(opr_id, get_crs_wkt(crs))
+
+
+@cached(disk=False)
+def prepare_supersection(supersection_id, crs_wkt):
+    supersections = reproject_supersections(crs_wkt)
+    geom = unary_union(supersections[supersections['ss_id'] == supersection_id].geometry.values)
+    shapely.prepare(geom)
+    return geom
+
+
+def get_prepared_supersection(supersection_id, crs='epsg:4326'):
+    '''dissolved supersection footprint in `crs`, prepared for repeated contains/intersects tests'''
+    return prepare_supersection(supersection_id, get_crs_wkt(crs))
+
+
+@cached(disk=False)
+def load_states_tree():
+    '''STRtree over the state polygons, in the order of `load_states`'''
+    return STRtree(np.asarray(load_states().geometry.values))
+
+
 def get_overlapping_states(geometry):
     states = load_states()
-    return states[states.intersects(geometry)]['postal'].str.lower().to_list()
+    idx = np.sort(load_states_tree().query(geometry, predicate='intersects'))
+    return states['postal'].iloc[idx].str.lower().to_list()
+
+
+@cached(disk=False)
+def load_supersection_states(buffer=0):
+    '''lookup from ss_id to the postal codes of the states its (optionally buffered) footprint overlaps
+
+    Built with one bulk STRtree query and persisted in the local cache dir, keyed by the supersection
+    and state geometries and the buffer.
+    '''
+    supersections = load_supersections()
+    states = load_states()
+    fingerprint = hashlib.sha256(
+        f'{get_geometry_fingerprint(supersections)}-{get_geometry_fingerprint(states)}-{buffer}'.encode()
+    ).hexdigest()[:16]
+    fn = get_local_cache_dir() / SUPERSECTION_STATES_FN.format(fingerprint=fingerprint)
+    if fn.exists():
+        with open(fn) as f:
+            return {float(k): v for k, v in json.load(f).items()}
+
+    geoms = np.asarray(supersections.geometry.values)
+    if buffer:
+        geoms = shapely.buffer(geoms, buffer)
+    src, dst = load_states_tree().query(geoms, predicate='intersects')
+    postal = states['postal'].str.lower().values
+    ss_ids = supersections['ss_id'].values
+
+    lookup = {float(ss_id): set() for ss_id in ss_ids if not pd.isnull(ss_id)}
+    for i, j in zip(src.tolist(), dst.tolist()):
+        if not pd.isnull(ss_ids[i]):
+            lookup[float(ss_ids[i])].add(j)
+    # keep the state order of `get_overlapping_states`
+    lookup = {ss_id: [postal[j] for j in sorted(idx)] for ss_id, idx in lookup.items()}
+
+    with open(fn, 'w') as f:
+        json.dump(lookup, f)
+    return lookup
+
+
+def get_supersection_states(supersection_id, buffer=0):
+    '''postal codes of the states overlapping a supersection, from the precomputed lookup'''
+    return load_supersection_states(buffer=buffer)[float(supersection_id)]
+
+
+def get_assessment_area_states(assessment_area_id, buffer=0):
+    '''postal codes of the states overlapping an assessment area's supersection'''
+    return get_supersection_states(aa_code_to_ss_code()[float(assessment_area_id)], buffer=buffer)
+
+
+def get_geometry_fingerprint(gdf):
+    '''short hash of a GeoDataFrame's geometries, used to key derived data persisted to disk'''
+    digest = hashlib.sha256()
+    for wkb in gdf.geometry.to_wkb():
+        digest.update(wkb)
+    return digest.hexdigest()[:16]
+
+
+def build_supersection_adjacency(supersections):
+    '''map each supersection (by position) to the supersections that intersect its buffered footprint
+
+    A single bulk STRtree query replaces one polygon sweep per lookup. The graph is a superset of
+    the `overlaps` neighbors used by `get_bordering_supersections`, which only re-tests candidates.
+    '''
+    geoms = np.asarray(supersections.geometry.values)
+    tree = STRtree(geoms)
+    src, dst = tree.query(shapely.buffer(geoms, BORDER_BUFFER), predicate='intersects')
+    adjacency = {i: [] for i in range(len(supersections))}
+    for i, j in zip(src.tolist(), dst.tolist()):
+        if i != j:
+            adjacency[i].append(j)
+    return adjacency
+
+
+@cached(disk=False)
+def load_supersection_adjacency():
+    '''supersection adjacency graph, built once and persisted in the local cache dir'''
+    supersections = load_supersections()
+    fingerprint = get_geometry_fingerprint(supersections)
+    fn = get_local_cache_dir() / SUPERSECTION_ADJACENCY_FN.format(fingerprint=fingerprint)
+    if fn.exists():
+        with open(fn) as f:
+            return {int(k): v for k, v in json.load(f).items()}
+
+    adjacency = build_supersection_adjacency(supersections)
+    with open(fn, 'w') as f:
+        json.dump(adjacency, f)
+    return adjacency
+
+
+@cached(disk=False)
+def get_dissolved_supersections(supersection_ids: frozenset, buffer=0):
+    '''memoized union of a set of supersections, optionally buffered'''
+    supersections = load_supersections()
+    geom = unary_union(supersections[supersections.ss_id.isin(supersection_ids)].geometry.values)
+    return geom.buffer(buffer) if buffer else geom
 
 
 def get_bordering_supersections(supersection_ids: list):
     supersections = load_supersections()
-    subset = supersections[supersections.ss_id.isin(supersection_ids)]
-    geom = cascaded_union(subset['geometry'])
+    members = np.flatnonzero(supersections.ss_id.isin(supersection_ids))
+    subset = supersections.iloc[members]
+
+    adjacency = load_supersection_adjacency()
+    candidates = sorted(set(chain(members, *(adjacency[i] for i in members))))
+    candidates = supersections.iloc[candidates]
     # buffer slightly to avoid touches/overlaps confusion [if just touch but no intersect overlaps wont return]
-    overlapping = supersections[supersections.geometry.overlaps(geom.buffer(0.01))]
+    geom = get_dissolved_supersections(frozenset(supersection_ids), buffer=BORDER_BUFFER)
+    overlapping = candidates[candidates.geometry.overlaps(geom)]
     return pd.concat([subset, overlapping])
+
+
+@cached(disk=False)
+def get_bordering_aoi(supersection_ids: frozenset):
+    '''memoized dissolved footprint of a set of supersections and their bordering supersections'''
+    return unary_union(get_bordering_supersections(list(supersection_ids)).geometry.values)
@@ -1,8 +1,7 @@
-from functools import lru_cache
-
 import numpy as np
 import pandas as pd
 
+from ..cache import cached
 from ..data import cat
 
 ifm_opr_ids = [
@@ -102,7 +101,7 @@ ifm_opr_ids = [
 ]
 
 
-@lru_cache(maxsize=None)
+@cached
 def load_most_recent_issuance():
     return pd.read_excel(
         "https://ww2.arb.ca.gov/sites/default/files/2022-07/nc-arboc_issuance.xlsx",
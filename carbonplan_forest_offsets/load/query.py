@@ -0,0 +1,156 @@
+import fsspec
+from fsspec.implementations.local import LocalFileSystem
+
+from ..analysis.rfia import RFIA_STORE_DIR
+from ..data import get_catalog_urlpath, get_local_cache_dir
+
+FIA_TABLES = ['cond', 'plot', 'tree']
+
+
+def get_connection(threads=None):
+    '''open an in-memory DuckDB connection for querying the FIA and rFIA parquet data
+
+    DuckDB is an optional dependency; it is only imported here.
+    '''
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError('the SQL query layer requires duckdb, `pip install duckdb`') from e
+
+    con = duckdb.connect()
+    if threads is not None:
+        con.execute(f'SET threads = {int(threads)}')
+    return con
+
+
+def get_parquet_glob(con, urlpath, storage_options=None):
+    '''path DuckDB can read for a parquet urlpath, registering its fsspec filesystem'''
+    fs, path = fsspec.core.url_to_fs(urlpath, **(storage_options or {}))
+    if fs.isdir(path):
+        path = path.rstrip('/') + '/*.parquet'  # e.g. parquet datasets written by dask
+    if not isinstance(fs, LocalFileSystem):
+        con.register_filesystem(fs)
+        path = fs.unstrip_protocol(path)
+    return path.replace("'", "''")
+
+
+def register_view(con, name, urlpaths):
+    '''create (or replace) view `name` as the union of `{postal_code: (urlpath, storage_options)}`
+
+    Urlpaths are resolved from the catalog with `data.get_catalog_urlpath`.
+    '''
+    selects = [
+        f"SELECT *, '{postal_code}' AS postal_code "
+        f"FROM read_parquet('{get_parquet_glob(con, urlpath, storage_options)}')"
+        for postal_code, (urlpath, storage_options) in urlpaths.items()
+    ]
+    con.execute(f'CREATE OR REPLACE VIEW {name} AS ' + ' UNION ALL BY NAME '.join(selects))
+
+
+def register_fia(con, postal_codes, tables=FIA_TABLES):
+    '''register `fia_cond`, `fia_plot` and `fia_tree` views over the raw FIA tables of some states'''
+    if isinstance(postal_codes, str):
+        postal_codes = [postal_codes]
+    for table in tables:
+        urlpaths = {
+            postal_code.lower(): get_catalog_urlpath(
+                'fia', postal_code=postal_code.lower(), table=table
+            )
+            for postal_code in postal_codes
+        }
+        register_view(con, f'fia_{table}', urlpaths)
+    return con
+
+
+def register_fia_long(con, postal_codes):
+    '''register a `fia_long` view over the processed per condition FIA tables of some states'''
+    if isinstance(postal_codes, str):
+        postal_codes = [postal_codes]
+    urlpaths = {
+        postal_code.lower(): get_catalog_urlpath('fia_long', postal_code=postal_code.lower())
+        for postal_code in postal_codes
+    }
+    register_view(con, 'fia_long', urlpaths)
+    return con
+
+
+def register_rfia(con, path=None):
+    '''register an `rfia` view over the local rFIA store (see `analysis.rfia.ingest_rfia_data`)'''
+    if path is None:
+        path = get_local_cache_dir() / RFIA_STORE_DIR
+    if not path.exists():
+        raise FileNotFoundError(f'no rFIA store at {path}, run `ingest_rfia_data` first')
+
+    glob = str(path / '**' / '*.parquet').replace("'", "''")
+    con.execute(
+        f"CREATE OR REPLACE VIEW rfia AS SELECT * FROM read_parquet('{glob}', hive_partitioning = true)"
+    )
+    return con
+
+
+def query_slag_per_condition(con, private_only=True):
+    '''SLAG (tCO2e/acre) per condition from the `fia_long` view, as in `load_fia_state_long`'''
+    owner = 'AND OWNCD = 46' if private_only else ''
+    return con.execute(
+        f'''
+        SELECT *, adj_ag_biomass * (44 / 12) * (1 / 2.47) * 0.5 AS slag_co2e_acre
+        FROM fia_long
+        WHERE LAT IS NOT NULL AND LON IS NOT NULL AND adj_ag_biomass IS NOT NULL {owner}
+        '''
+    ).df()
+
+
+def query_basal_area_fractions(con):
+    '''fraction of live tree basal area per species for every condition, from the `fia_tree` view
+
+    Matches `assign_project_fldtypcd.fractional_basal_area_by_species`, in long format.
+    '''
+    return con.execute(
+        '''
+        WITH basal_area AS (
+            SELECT
+                PLT_CN,
+                CONDID,
+                SPCD,
+                SUM(pi() * pow(DIA / (2 * 12), 2) * TPA_UNADJ) AS unadj_basal_area
+            FROM fia_tree
+            WHERE STATUSCD = 1
+            GROUP BY PLT_CN, CONDID, SPCD
+        )
+        SELECT
+            PLT_CN,
+            CONDID,
+            SPCD,
+            ROUND(unadj_basal_area / SUM(unadj_basal_area) OVER (PARTITION BY PLT_CN, CONDID), 4)
+                AS fraction_species
+        FROM basal_area
+        QUALIFY fraction_species IS NOT NULL AND NOT isnan(fraction_species)
+        ORDER BY PLT_CN, CONDID, SPCD
+        '''
+    ).df()
+
+
+def query_cp_by_inventory_year(con, assessment_area_ids=None, site_class='all'):
+    '''rFIA common practice (tCO2e/acre) per assessment area and inventory year, from the `rfia` view
+
+    Uses the same filters as `analysis.rfia.load_rfia_data` and the aggregation of
+    `analysis.rfia.get_rfia_slag_co2e_acre`.
+    '''
+    assessment_areas = ''
+    if assessment_area_ids is not None:
+        ids = ', '.join(str(int(aa)) for aa in assessment_area_ids)
+        assessment_areas = f'AND assessment_area_id IN ({ids})'
+
+    return con.execute(
+        f'''
+        SELECT
+            assessment_area_id,
+            YEAR,
+            SUM(CARB_TOTAL) / SUM(AREA_TOTAL) * 44 / 12 * 0.907185 AS common_practice
+        FROM rfia
+        WHERE site = ? AND CARB_TOTAL > 0 AND YEAR >= 2010 {assessment_areas}
+        GROUP BY assessment_area_id, YEAR
+        ORDER BY assessment_area_id, YEAR
+        ''',
+        [site_class],
+    ).df()
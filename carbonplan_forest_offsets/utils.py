@@ -1,6 +1,10 @@
+import operator
+
 import geopandas
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
+from scipy import ndimage
+from scipy.spatial import cKDTree
 
 from .data import cat
 
@@ -9,12 +13,169 @@ def to_geodataframe(
     df: pd.DataFrame, lat_key: str = 'LAT', lon_key: str = 'LON'
 ) -> geopandas.GeoDataFrame:
     '''helper function to covert DataFrame to GeoDataFrame'''
+    # build the point array in one vectorized call rather than one shapely object per row
     geo_df = geopandas.GeoDataFrame(
-        df, crs='epsg:4326', geometry=[Point(xy) for xy in zip(df[lon_key], df[lat_key])]
+        df, crs='epsg:4326', geometry=geopandas.points_from_xy(df[lon_key], df[lat_key])
     )
     return geo_df
 
 
+def as_geodataframe(
+    df: pd.DataFrame, lat_key: str = 'LAT', lon_key: str = 'LON'
+) -> geopandas.GeoDataFrame:
+    '''materialize point geometries for frames loaded with `geometry=False`; GeoDataFrames pass through'''
+    if isinstance(df, geopandas.GeoDataFrame):
+        return df
+    return to_geodataframe(df, lat_key=lat_key, lon_key=lon_key)
+
+
+def clip_points(df: pd.DataFrame, geometry, lat_key: str = 'LAT', lon_key: str = 'LON'):
+    '''clip lat/lon points to a (epsg:4326) geometry, only building points inside its bounding box'''
+    minx, miny, maxx, maxy = geometry.bounds
+    in_bounds = df[lon_key].between(minx, maxx) & df[lat_key].between(miny, maxy)
+    return geopandas.clip(
+        as_geodataframe(df[in_bounds], lat_key=lat_key, lon_key=lon_key), geometry
+    )
+
+
+def get_nearest_valid_cells(valid: np.ndarray, transform, x, y, margin: int = 16):
+    '''row and column of the valid raster cell nearest to each `(x, y)` point
+
+    Points are mapped to cells through the inverse of the raster's affine `transform`, an O(1) lookup
+    per point. Points that land on an invalid (e.g. nodata or clipped) cell, or outside the raster,
+    fall back to the nearest valid cell. Within `margin` cells of the raster it is found with a
+    Euclidean distance transform over the raster padded by `margin`; points further out query a KDTree
+    over the valid cell centers instead, so the transform never grows past the raster window.
+    '''
+    inverse = np.linalg.inv([[transform.a, transform.b], [transform.d, transform.e]])
+    cols, rows = inverse @ np.stack([np.asarray(x) - transform.c, np.asarray(y) - transform.f])
+    rows = np.floor(rows).astype(int)
+    cols = np.floor(cols).astype(int)
+    sampling = (abs(transform.e), abs(transform.a))
+    n_rows, n_cols = valid.shape
+
+    inside = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+    missing = ~inside
+    missing[inside] = ~valid[rows[inside], cols[inside]]
+    near = (
+        (rows >= -margin) & (rows < n_rows + margin) & (cols >= -margin) & (cols < n_cols + margin)
+    )
+
+    nearest_rows, nearest_cols = rows.copy(), cols.copy()
+    padded_missing = missing & near
+    if padded_missing.any():
+        indices = ndimage.distance_transform_edt(
+            ~np.pad(valid, margin),
+            sampling=sampling,
+            return_distances=False,
+            return_indices=True,
+        )
+        padded_rows = rows[padded_missing] + margin
+        padded_cols = cols[padded_missing] + margin
+        nearest_rows[padded_missing] = indices[0][padded_rows, padded_cols] - margin
+        nearest_cols[padded_missing] = indices[1][padded_rows, padded_cols] - margin
+
+    far = missing & ~near
+    if far.any():
+        valid_rows, valid_cols = np.nonzero(valid)
+        tree = cKDTree(np.stack([valid_rows * sampling[0], valid_cols * sampling[1]], axis=1))
+        _, idx = tree.query(np.stack([rows[far] * sampling[0], cols[far] * sampling[1]], axis=1))
+        nearest_rows[far] = valid_rows[idx]
+        nearest_cols[far] = valid_cols[idx]
+
+    return nearest_rows, nearest_cols
+
+
+FILTER_OPS = {
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda series, value: series.isin(value),
+    'not in': lambda series, value: ~series.isin(value),
+}
+
+
+def apply_filters(df: pd.DataFrame, filters) -> pd.DataFrame:
+    '''apply parquet-style `(column, op, value)` filters to a DataFrame
+
+    Some parquet engines only use filters to skip row groups, so loaders that push filters into the
+    reader re-apply them here to guarantee row-level results. Filtering on a column that is not in
+    `df` raises a KeyError rather than silently returning unfiltered rows.
+    '''
+    if not filters:
+        return df
+
+    missing = [column for column, _, _ in filters if column not in df]
+    if missing:
+        raise KeyError(f'cannot filter on columns not in the data: {missing}')
+
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        mask &= FILTER_OPS[op](df[column], value).values
+    return df[mask]
+
+
+FIA_CODE_COLUMNS = [
+    'OWNCD',
+    'FORTYPCD',
+    'FLDTYPCD',
+    'SITECLCD',
+    'COND_STATUS_CD',
+    'PLOT_STATUS_CD',
+    'STATUSCD',
+    'SPCD',
+    'CONDID',
+    'MEASYEAR',
+    'INVYR',
+]
+FIA_CATEGORY_COLUMNS = ['postal_code', 'ECOSUBCD']
+FIA_FLOAT32_COLUMNS = [
+    'adj_ag_biomass',
+    'slag_co2e_acre',
+    'STDAGE',
+    'SLOPE',
+    'ASPECT',
+    'ELEV',
+    'CONDPROP_UNADJ',
+    'TPA_UNADJ',
+    'DIA',
+    'CARBON_AG',
+    'unadj_basal_area',
+]
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    '''downcast FIA code, string and measurement columns to compact dtypes
+
+    Codes become the smallest integer type that holds them (float32 if they contain NaN, which is
+    exact for FIA codes), repeated strings become categoricals and measurements become float32.
+    Identifiers (CN, PLT_CN) and LAT/LON keep their full precision. The number of bytes saved is
+    recorded in `df.attrs['nbytes_saved']`.
+    '''
+    before = df.memory_usage(deep=True).sum()
+    df = df.copy()
+
+    for column in FIA_CODE_COLUMNS:
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            if df[column].isna().any():
+                df[column] = df[column].astype(np.float32)
+            else:
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+    for column in FIA_CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    for column in FIA_FLOAT32_COLUMNS:
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+
+    df.attrs['nbytes_saved'] = int(before - df.memory_usage(deep=True).sum())
+    return df
+
+
 def load_arb_fortypcds():
     '''load map between assessment area code and its associated fortypcds'''
     d = cat.arb_fortypcds.read()[0]
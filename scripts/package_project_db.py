@@ -28,6 +28,7 @@
 import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import geopandas
@@ -319,11 +320,11 @@ def main(project_dir, target_dir, exclude_graduated_projects=True):
     write_shapes(project_db.index, project_dir, target_dir)
 
     # Here we extract the centroid of each project from the project geometries.
-    coords = []
     print('getting project centroids')
-    for i, proj in tqdm(enumerate(project_db.index)):
-        gdf = geopandas.GeoDataFrame.from_file(f"{target_dir}/projects/{proj}/shape.json")
-        coords.append(get_centroids(gdf))
+    fns = [f"{target_dir}/projects/{proj}/shape.json" for proj in project_db.index]
+    with ThreadPoolExecutor() as executor:
+        gdfs = executor.map(geopandas.GeoDataFrame.from_file, fns)
+        coords = [get_centroids(gdf) for gdf in tqdm(gdfs, total=len(fns))]
     # add project centroids from shapefiles to a new column
     project_db[("project", "shape_centroid", "")] = coords
 
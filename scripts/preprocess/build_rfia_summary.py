@@ -0,0 +1,6 @@
+from carbonplan_forest_offsets.analysis.rfia import build_rfia_summary
+
+if __name__ == '__main__':
+    '''(re)builds the local rFIA summary index used to calculate fortyp weighted SLAG'''
+    summary = build_rfia_summary()
+    print(f'wrote {len(summary)} rows to rFIA summary')
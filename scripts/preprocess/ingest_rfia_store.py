@@ -0,0 +1,7 @@
+from carbonplan_forest_offsets.analysis.rfia import build_rfia_summary, ingest_rfia_data
+
+if __name__ == '__main__':
+    '''pulls every rFIA output into the local rFIA store and rebuilds the rFIA summary index'''
+    path = ingest_rfia_data()
+    print(f'wrote rFIA store to {path}')
+    build_rfia_summary()
@@ -1,31 +1,57 @@
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 DIRNAME = Path(__file__).parents[2] / 'data' / 'fia'  # where FIA data stored
+CHUNKSIZE = 500_000
 
 
-def patch_tree_with_regional_biomass(postal_code, input_dir=DIRNAME):
-    '''modify FIA `TREE` table to contain regional biomass values -- needed for PNW work unit'''
-    tree_path = Path(input_dir) / f"{postal_code}_TREE.csv"
-    regional_path = Path(input_dir) / f"{postal_code}_TREE_REGIONAL_BIOMASS.csv"
-    if not ((tree_path.exists()) & (regional_path.exists())):
-        raise FileNotFoundError('Patching biomass requires TREE_REGIONAL_BIOMASS and TREE tables')
+def load_regional_drybiot(regional_path):
+    '''REGIONAL_DRYBIOT as a Series with a sorted TRE_CN index, used for hashed lookups by `.map`'''
+    regional_tree = pd.read_csv(regional_path, usecols=['TRE_CN', 'REGIONAL_DRYBIOT'])
+    return regional_tree.set_index('TRE_CN')['REGIONAL_DRYBIOT'].astype(float).sort_index()
 
-    backup_path = input_dir / 'backup' / tree_path.name
-    os.makedirs(backup_path.parent, exist_ok=True)
 
-    if backup_path.exists():
-        shutil.copy(backup_path, tree_path)
-    else:
-        shutil.copy(tree_path, backup_path)
+def combine_dtypes(a, b):
+    '''dtype pandas infers for a column read whole, given the dtypes inferred for two of its chunks'''
+    if a == b:
+        return a
+    if a.kind in 'iuf' and b.kind in 'iuf':
+        return np.dtype('float64')  # e.g. an int column that picks up NaNs, or an all NaN chunk
+    return np.dtype(object)
 
-    tree = pd.read_csv(tree_path)
 
-    regional_tree = pd.read_csv(regional_path, usecols=['TRE_CN', 'REGIONAL_DRYBIOT'])
+def infer_csv_dtypes(path, chunksize=CHUNKSIZE):
+    '''consistent dtype per column of a csv, read chunk by chunk
 
+    Inference on a single chunk is not enough: a column can be all NaN (float) in one chunk and
+    hold strings in another, or be int until it picks up NaNs. Reading every chunk with these dtypes
+    gives the same types as reading the file at once.
+    '''
+    dtypes = {}
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            dtypes[column] = combine_dtypes(dtypes[column], dtype) if column in dtypes else dtype
+    return {column: str if dtype == object else dtype for column, dtype in dtypes.items()}
+
+
+def get_parquet_schema(tree, dtypes):
+    '''arrow schema of a patched chunk, with string columns typed even if a chunk is all null'''
+    schema = pa.Schema.from_pandas(tree, preserve_index=False)
+    for column, dtype in dtypes.items():
+        if dtype is str:
+            i = schema.get_field_index(column)
+            schema = schema.set(i, pa.field(column, pa.string()))
+    return schema
+
+
+def patch_chunk(tree, regional_drybiot):
     tree['DRYBIO_TOP'] = 0
     tree['DRYBIO_SAPLING'] = 0
     tree['DRYBIO_WDLD_SPP'] = 0
@@ -33,14 +59,70 @@ def patch_tree_with_regional_biomass(postal_code, input_dir=DIRNAME):
         'DRYBIO_BOLE'
     ] = 0  # zero out just in case there are gaps between TREE and REGIONAL_BIOMASS
 
-    tree['DRYBIO_BOLE'] = tree['CN'].map(
-        regional_tree.set_index('TRE_CN')['REGIONAL_DRYBIOT'].to_dict()
-    )
+    tree['DRYBIO_BOLE'] = tree['CN'].map(regional_drybiot)
+    return tree
 
-    tree.to_csv(tree_path, index=False)
 
+def patch_tree_with_regional_biomass(
+    postal_code, input_dir=DIRNAME, chunksize=CHUNKSIZE, output_format='csv'
+):
+    '''modify FIA `TREE` table to contain regional biomass values -- needed for PNW work unit
 
-if __name__ == '__main__':
+    The TREE table is streamed from its backup in `chunksize` rows and written out incrementally, so
+    only the (two column) regional biomass index and one chunk are held in memory at a time. Column
+    dtypes are fixed up front (see `infer_csv_dtypes`), so every chunk is written with the same types.
+    output_format: `csv` replaces `{postal_code}_TREE.csv` in place, `parquet` writes
+    `{postal_code}_TREE.parquet` next to it instead
+    '''
+    if output_format not in ['csv', 'parquet']:
+        raise ValueError(f'output format must be csv or parquet, got {output_format}')
 
+    input_dir = Path(input_dir)
+    tree_path = input_dir / f"{postal_code}_TREE.csv"
+    regional_path = input_dir / f"{postal_code}_TREE_REGIONAL_BIOMASS.csv"
+    if not ((tree_path.exists()) & (regional_path.exists())):
+        raise FileNotFoundError('Patching biomass requires TREE_REGIONAL_BIOMASS and TREE tables')
+
+    backup_path = input_dir / 'backup' / tree_path.name
+    os.makedirs(backup_path.parent, exist_ok=True)
+
+    if not backup_path.exists():
+        shutil.copy(tree_path, backup_path)
+
+    regional_drybiot = load_regional_drybiot(regional_path)
+
+    out_path = tree_path.with_suffix(f'.{output_format}')
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+
+    dtypes = infer_csv_dtypes(backup_path, chunksize=chunksize)
+
+    writer = None
+    try:
+        chunks = pd.read_csv(backup_path, chunksize=chunksize, dtype=dtypes)
+        for i, tree in enumerate(chunks):
+            tree = patch_chunk(tree, regional_drybiot)
+            if output_format == 'csv':
+                tree.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            else:
+                if writer is None:
+                    schema = get_parquet_schema(tree, dtypes)
+                    writer = pq.ParquetWriter(tmp_path, schema)
+                writer.write_table(pa.Table.from_pandas(tree, schema=schema, preserve_index=False))
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(tmp_path, out_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if tmp_path.exists():
+            tmp_path.unlink()  # a failed run leaves no partial output behind
+
+    return out_path
+
+
+if __name__ == '__main__':
     pnw = ['CA', 'OR', 'WA', 'AK']
-    [patch_tree_with_regional_biomass(postal_code) for postal_code in pnw]
+    with ProcessPoolExecutor(max_workers=len(pnw)) as executor:
+        for path in executor.map(patch_tree_with_regional_biomass, pnw):
+            print(f'patched {path}')
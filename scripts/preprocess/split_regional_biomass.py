@@ -0,0 +1,6 @@
+from carbonplan_forest_offsets.load.fia import split_regional_biomass
+
+if __name__ == '__main__':
+    '''streams TREE_REGIONAL_BIOMASS once and writes one local parquet partition per state'''
+    path = split_regional_biomass()
+    print(f'wrote regional biomass partitions to {path}')
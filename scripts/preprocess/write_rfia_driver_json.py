@@ -5,7 +5,11 @@ import pathlib
 import fsspec
 import geopandas
 
-from carbonplan_forest_offsets.load.geometry import get_overlapping_states, load_supersections
+from carbonplan_forest_offsets.load.geometry import (
+    get_overlapping_states,
+    get_supersection_states,
+    load_supersections,
+)
 from carbonplan_forest_offsets.utils import aa_code_to_ss_code, load_arb_fortypcds
 
 PROJECT_SUPERSECTIONS = [
@@ -75,15 +79,18 @@ if __name__ == '__main__':
         if ss_id in project_list:
 
             supersection = supersections.loc[supersections['ss_id'] == ss_id]
+            if args.filename:
+                postal_codes = get_overlapping_states(supersection.geometry.item())
+            else:
+                # supersections are shared by many assessment areas, so use the precomputed lookup
+                postal_codes = get_supersection_states(ss_id)
+
             record = {
                 'assessment_area_id': aa_id,
                 'fortypcds': fortypcds,
                 'supersection_name': supersection['SSection'].item(),
                 'supersection_id': supersection['ss_id'].item(),
-                'postal_codes': [
-                    postal_code.upper()
-                    for postal_code in get_overlapping_states(supersection.geometry.item())
-                ],
+                'postal_codes': [postal_code.upper() for postal_code in postal_codes],
             }
 
             store.append(record)
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def local_cache_dir(monkeypatch, tmp_path):
+    '''keep cached loader results written during tests out of the user's cache dir'''
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from carbonplan_forest_offsets.analysis.allocation import get_arbocs_matrix, get_rp1_arbocs
+from carbonplan_forest_offsets.analysis.project_crediting_error import (
+    get_project_components,
+    get_recalculated_arbocs,
+    get_recalculated_arbocs_matrix,
+)
+
+
+def make_project(opr_id, secondary_effects):
+    return {
+        'opr_id': opr_id,
+        'acreage': 1_000,
+        'carbon': {'initial_carbon_stock': {'value': 120}},
+        'baseline': {'ifm_1': 80_000, 'ifm_3': 5_000, 'ifm_7': 2_000, 'ifm_8': 1_000},
+        'rp_1': {
+            'ifm_1': 110_000,
+            'ifm_3': 6_000,
+            'ifm_7': 1_500,
+            'ifm_8': 900,
+            'confidence_deduction': 0.025,
+            'secondary_effects': secondary_effects,
+        },
+    }
+
+
+@pytest.fixture
+def projects():
+    return [make_project('ACR189', -500), make_project('CAR1217', 250)]
+
+
+def test_get_arbocs_matrix_matches_get_rp1_arbocs(projects):
+    components = get_project_components(projects)
+    arbocs = get_arbocs_matrix(components['opr_id'], components['baseline'], components['rp_1'])
+
+    expected = [get_rp1_arbocs(p['opr_id'], dict(p['baseline']), dict(p['rp_1'])) for p in projects]
+    assert arbocs.shape == (2, 1)
+    np.testing.assert_allclose(arbocs[:, 0], expected)
+
+
+def test_get_recalculated_arbocs_matrix(projects):
+    components = get_project_components(projects)
+    alternate_cp = np.array([[60.0, 70.0, 80.0], [50.0, 55.0, 60.0]])
+
+    arbocs = get_recalculated_arbocs_matrix(components, alternate_cp)
+    assert arbocs.shape == (2, 3)
+
+    # no landfill exclusion for the first project, so the scalar path must agree
+    expected = [get_recalculated_arbocs(projects[0], cp) for cp in alternate_cp[0]]
+    np.testing.assert_allclose(arbocs[0], expected)
+
+    # a shared 1-d grid broadcasts across projects
+    shared = get_recalculated_arbocs_matrix(components, alternate_cp[0])
+    np.testing.assert_allclose(shared[0], arbocs[0])
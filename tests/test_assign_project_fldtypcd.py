@@ -0,0 +1,173 @@
+import dask.dataframe as dd
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction import DictVectorizer
+
+from carbonplan_forest_offsets.analysis import assign_project_fldtypcd
+from carbonplan_forest_offsets.analysis.assign_project_fldtypcd import (
+    build_species_fraction_matrix,
+    fractional_basal_area_by_species,
+)
+
+
+def test_build_species_fraction_matrix_matches_dicts():
+    rng = np.random.default_rng(0)
+    n = 500
+    trees = pd.DataFrame(
+        {
+            'PLT_CN': rng.integers(0, 40, n),
+            'CONDID': rng.integers(1, 3, n),
+            'SPCD': rng.choice([12, 97, 202, 316, 833], n),
+            'unadj_basal_area': rng.uniform(0, 5, n),
+        }
+    )
+    trees.loc[::50, 'unadj_basal_area'] = np.nan
+
+    result = build_species_fraction_matrix(trees)
+    vec = result['dictvectorizer']
+
+    expected = trees.groupby(['PLT_CN', 'CONDID']).apply(fractional_basal_area_by_species)
+    expected = vec.transform(expected.loc[result['conditions']].values)
+
+    np.testing.assert_allclose(result['features'].toarray(), expected.toarray())
+
+
+def test_build_species_fraction_matrix_fixed_vocabulary():
+    trees = pd.DataFrame(
+        {'PLT_CN': [1, 1, 2], 'CONDID': [1, 1, 1], 'SPCD': [12, 97, 12], 'unadj_basal_area': 1.0}
+    )
+    result = build_species_fraction_matrix(trees, spcds=[12, 97, 202])
+
+    assert result['features'].shape == (2, 3)
+    np.testing.assert_allclose(result['features'].sum(axis=1), 1)
+    features = result['dictvectorizer'].transform({'202': 1.0})
+    assert features[0, result['dictvectorizer'].vocabulary_['202']] == 1
+
+
+def test_load_regional_classifier_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(
+        assign_project_fldtypcd, 'get_fia_fingerprint', lambda postal_codes: {'fia': 'v1'}
+    )
+
+    calls = []
+
+    def load_classification_data(postal_codes, target_var='FORTYPCD', aoi=None):
+        calls.append(postal_codes)
+        rng = np.random.default_rng(0)
+        y = rng.choice([101, 102], 100)
+        return {'features': rng.uniform(size=(100, 3)), 'targets': y, 'dictvectorizer': None}
+
+    monkeypatch.setattr(
+        assign_project_fldtypcd, 'load_classification_data', load_classification_data
+    )
+
+    first = assign_project_fldtypcd.load_regional_classifier(['ca'], radii=[0.2, 0.4], name='1')
+    second = assign_project_fldtypcd.load_regional_classifier(['ca'], radii=[0.2, 0.4], name='1')
+    assert len(calls) == 1
+    assert second['radius'] == first['radius']
+
+    assign_project_fldtypcd.load_regional_classifier(['ca'], radii=[0.3], name='1')
+    assert len(calls) == 2
+
+    # editing the encoding or fitting code invalidates classifiers fit with the old code
+    monkeypatch.setattr(assign_project_fldtypcd, 'get_source_fingerprint', lambda func: 'edited')
+    assign_project_fldtypcd.load_regional_classifier(['ca'], radii=[0.3], name='1')
+    assert len(calls) == 3
+    assert (
+        len(list((tmp_path / assign_project_fldtypcd.CLASSIFIER_CACHE_DIR).glob('1-*.joblib'))) == 1
+    )
+
+
+def test_load_classification_data_matches_baseline_encoding(monkeypatch):
+    rng = np.random.default_rng(0)
+    n_conds = 200
+    conds = pd.DataFrame(
+        {
+            'PLT_CN': np.arange(n_conds),
+            'CONDID': 1,
+            'FORTYPCD': rng.choice([101, 102], n_conds),
+            'FLDTYPCD': 101,
+            'INVYR': np.where(np.arange(n_conds) < 150, 2005, 2016),
+            'LAT': 40.0,
+            'LON': -120.0,
+        }
+    )
+    n_trees = 2_000
+    trees = pd.DataFrame(
+        {
+            'PLT_CN': rng.integers(0, n_conds, n_trees),
+            'CONDID': 1,
+            'SPCD': rng.choice([12, 97, 202], n_trees),
+            'unadj_basal_area': rng.uniform(0, 5, n_trees),
+        }
+    )
+    # species only found on conditions that are filtered out (measured after 2012)
+    trees.loc[trees['PLT_CN'] >= 150, 'SPCD'] = rng.choice(
+        [316, 833], (trees['PLT_CN'] >= 150).sum()
+    )
+    trees.loc[::97, 'unadj_basal_area'] = 1e-7  # fractions that round to zero keep their key
+
+    monkeypatch.setattr(
+        assign_project_fldtypcd,
+        'load_live_tree_ddf',
+        lambda postal_codes: dd.from_pandas(trees, npartitions=2),
+    )
+    monkeypatch.setattr(
+        assign_project_fldtypcd, 'load_cond_classification_data', lambda postal_codes: conds
+    )
+    result = assign_project_fldtypcd.load_classification_data(['ca'])
+
+    # the dict based encoding this replaced, fit on the retained conditions only
+    fraction_species = (
+        trees.groupby(['PLT_CN', 'CONDID'])
+        .apply(fractional_basal_area_by_species)
+        .rename('fraction_species')
+    )
+    data = conds[conds['INVYR'] < 2013].join(fraction_species, on=['PLT_CN', 'CONDID'])
+    data = data.dropna(subset=['FORTYPCD', 'fraction_species'])
+    vec = DictVectorizer()
+    expected = vec.fit_transform(data['fraction_species'].values)
+
+    assert list(result['dictvectorizer'].get_feature_names_out()) == list(
+        vec.get_feature_names_out()
+    )
+    assert '316' not in result['dictvectorizer'].vocabulary_
+    np.testing.assert_allclose(result['features'].toarray(), expected.toarray())
+    np.testing.assert_array_equal(result['targets'], data['FORTYPCD'].values)
+    project = {'12': 0.5, '97': 0.25, '316': 0.25}
+    np.testing.assert_allclose(
+        result['dictvectorizer'].transform(project).toarray(), vec.transform(project).toarray()
+    )
+
+
+def test_load_regional_classifier_keeps_other_regions(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    fingerprints = []
+    monkeypatch.setattr(
+        assign_project_fldtypcd,
+        'get_fia_fingerprint',
+        lambda postal_codes: fingerprints.append(postal_codes) or {'fia': 'v1'},
+    )
+
+    def load_classification_data(postal_codes, target_var='FORTYPCD', aoi=None):
+        rng = np.random.default_rng(0)
+        return {
+            'features': rng.uniform(size=(100, 3)),
+            'targets': rng.choice([101, 102], 100),
+            'dictvectorizer': None,
+        }
+
+    monkeypatch.setattr(
+        assign_project_fldtypcd, 'load_classification_data', load_classification_data
+    )
+
+    cache_dir = tmp_path / assign_project_fldtypcd.CLASSIFIER_CACHE_DIR
+    assign_project_fldtypcd.load_regional_classifier(['CA', 'OR'], radii=[0.2])
+    assign_project_fldtypcd.load_regional_classifier(['CA'], radii=[0.2])
+    assign_project_fldtypcd.load_regional_classifier(['CA'], radii=[0.4], use_cache=False)
+
+    names = sorted(fn.stem.rsplit('-', 1)[0] for fn in cache_dir.glob('*.joblib'))
+    assert names == ['ca', 'ca-or']
+    # the inputs are only fingerprinted once per call, after fitting when the cache is bypassed
+    assert len(fingerprints) == 3
@@ -0,0 +1,116 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import LineString, Point
+
+from carbonplan_forest_offsets import cache
+
+
+@pytest.fixture
+def loader(monkeypatch, tmp_path):
+    monkeypatch.setenv("FOREST_OFFSETS_CACHE_DIR", str(tmp_path))
+    calls = []
+
+    @cache.cached
+    def load_frame(n, value=0.0):
+        calls.append(n)
+        return pd.DataFrame({"x": [value] * n})
+
+    load_frame.calls = calls
+    yield load_frame
+    load_frame.cache_clear(disk=True)
+
+
+def test_cached_hits_and_misses(loader):
+    first = loader(10)
+    second = loader(10)
+    assert first is second
+    assert loader.calls == [10]
+    info = loader.cache_info()
+    assert (info.hits, info.disk_hits, info.misses) == (1, 0, 1)
+
+
+def test_cached_disk_tier_survives_clear(loader):
+    expected = loader(10, value=2.0)
+    loader.cache_clear()  # drops memory only, as if the process restarted
+
+    pd.testing.assert_frame_equal(loader(10, value=2.0), expected)
+    assert loader.calls == [10]
+    assert loader.cache_info().disk_hits == 1
+
+
+def test_cached_memory_budget_evicts_lru(loader):
+    budget = cache.loader_cache.max_bytes
+    nbytes = cache.get_nbytes(loader(1_000))
+    try:
+        cache.set_memory_budget(int(nbytes * 2.5))
+        loader(1_000, value=1.0)
+        loader(1_000, value=2.0)
+        info = loader.cache_info()
+        assert info.evictions == 1
+        assert info.nbytes <= cache.loader_cache.max_bytes
+    finally:
+        cache.set_memory_budget(budget)
+
+
+def test_cached_normalizes_arguments(loader):
+    first = loader(10)
+    assert loader(n=10) is first
+    assert loader(10, 0) is first
+    assert loader(10.0, value=0.0) is first
+    assert loader.calls == [10]
+
+
+def test_cached_fingerprint_invalidates(monkeypatch, tmp_path):
+    monkeypatch.setenv("FOREST_OFFSETS_CACHE_DIR", str(tmp_path))
+    inputs = {"version": 1}
+    calls = []
+
+    @cache.cached(fingerprint=lambda: inputs["version"])
+    def load_inputs(n):
+        calls.append(n)
+        return pd.DataFrame({"version": [inputs["version"]] * n})
+
+    assert load_inputs(3)["version"].tolist() == [1, 1, 1]
+    inputs["version"] = 2
+    load_inputs.cache_clear()  # the disk tier must not serve the old inputs either
+    assert load_inputs(3)["version"].tolist() == [2, 2, 2]
+    assert calls == [3, 3]
+    load_inputs.cache_clear(disk=True)
+
+
+def test_cached_source_fingerprint():
+    def load_a(n):
+        return n
+
+    def load_b(n):
+        return n + 1
+
+    assert cache.get_source_fingerprint(load_a) != cache.get_source_fingerprint(load_b)
+
+
+def test_get_nbytes_counts_geometries():
+    points = geopandas.GeoDataFrame(geometry=[Point(0, 0)] * 100)
+    lines = geopandas.GeoDataFrame(geometry=[LineString([(x, 0) for x in range(100)])] * 100)
+    assert cache.get_nbytes(points) < 100 * 100 * 16 < cache.get_nbytes(lines)
+    assert cache.get_nbytes(lines.geometry) > 100 * 100 * 16
+    assert cache.get_nbytes(lines.geometry.iloc[0]) > 100 * 16
+    assert cache.get_nbytes(shapely.STRtree(lines.geometry.values)) > 100 * 100 * 16
+
+
+def test_cached_concurrent_misses_load_once(loader):
+    barrier = threading.Barrier(8)
+
+    def load():
+        barrier.wait()
+        return loader(100, value=3.0)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: load(), range(8)))
+
+    assert loader.calls == [100]
+    assert all(result is results[0] for result in results)
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import geopandas
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from carbonplan_forest_offsets.load import geometry
+
+
+def make_supersections():
+    # 4 x 3 grid of unit squares, plus a sliver that only touches the grid at a corner
+    boxes = [box(x, y, x + 1, y + 1) for x in range(4) for y in range(3)]
+    boxes.append(box(4, 3, 5, 4))
+    return geopandas.GeoDataFrame(
+        {'ss_id': [float(i + 1) for i in range(len(boxes))]}, geometry=boxes, crs='epsg:4326'
+    )
+
+
+def get_bordering_supersections_sweep(supersections, supersection_ids):
+    subset = supersections[supersections.ss_id.isin(supersection_ids)]
+    geom = unary_union(subset['geometry'])
+    overlapping = supersections[supersections.geometry.overlaps(geom.buffer(0.01))]
+    return pd.concat([subset, overlapping])
+
+
+def make_states():
+    # two states splitting the grid at x = 1.5, and one far away
+    boxes = [box(-1, -1, 1.5, 5), box(1.5, -1, 6, 5), box(10, 10, 11, 11)]
+    return geopandas.GeoDataFrame({'postal': ['AA', 'BB', 'CC']}, geometry=boxes, crs='epsg:4326')
+
+
+CACHED_FUNCS = [
+    geometry.load_supersection_adjacency,
+    geometry.get_dissolved_supersections,
+    geometry.get_bordering_aoi,
+    geometry.load_states_tree,
+    geometry.load_supersection_states,
+    geometry.reproject_supersections,
+    geometry.reproject_states,
+    geometry.reproject_project_geometry,
+    geometry.prepare_supersection,
+]
+
+
+@pytest.fixture
+def supersections(monkeypatch):
+    supersections = make_supersections()
+    states = make_states()
+    monkeypatch.setattr(geometry, 'load_supersections', lambda **kwargs: supersections)
+    monkeypatch.setattr(geometry, 'load_states', lambda: states)
+    for func in CACHED_FUNCS:
+        func.cache_clear()
+    yield supersections
+    for func in CACHED_FUNCS:
+        func.cache_clear()
+
+
+@pytest.mark.parametrize('supersection_ids', [[1.0], [5.0], [5.0, 6.0], [12.0], [13.0]])
+def test_get_bordering_supersections_matches_sweep(supersections, supersection_ids):
+    expected = get_bordering_supersections_sweep(supersections, supersection_ids)
+    actual = geometry.get_bordering_supersections(supersection_ids)
+    assert actual['ss_id'].tolist() == expected['ss_id'].tolist()
+
+
+def test_supersection_adjacency_is_persisted(supersections, monkeypatch, local_cache_dir):
+    adjacency = geometry.load_supersection_adjacency()
+    assert len(list(local_cache_dir.glob('supersection_adjacency-*.json'))) == 1
+    assert adjacency[12] == [11]  # the corner sliver only neighbors the top right square
+
+    geometry.load_supersection_adjacency.cache_clear()
+    monkeypatch.setattr(geometry, 'build_supersection_adjacency', None)
+    assert geometry.load_supersection_adjacency() == adjacency
+
+
+def test_get_bordering_aoi(supersections):
+    aoi = geometry.get_bordering_aoi(frozenset([1.0]))
+    assert aoi.equals(box(0, 0, 2, 2))
+    assert geometry.get_bordering_aoi(frozenset([1.0])) is aoi
+
+
+def test_get_overlapping_states(supersections):
+    states = make_states()
+    for geom in [box(0, 0, 1, 1), box(1, 1, 2, 2), box(20, 20, 21, 21), box(-5, -5, 20, 20)]:
+        expected = states[states.intersects(geom)]['postal'].str.lower().to_list()
+        assert geometry.get_overlapping_states(geom) == expected
+
+
+@pytest.mark.parametrize('buffer', [0, 0.6])
+def test_supersection_states_lookup(supersections, monkeypatch, buffer):
+    for _, row in supersections.iterrows():
+        geom = row.geometry.buffer(buffer) if buffer else row.geometry
+        expected = geometry.get_overlapping_states(geom)
+        assert geometry.get_supersection_states(row.ss_id, buffer=buffer) == expected
+
+    monkeypatch.setattr(geometry, 'aa_code_to_ss_code', lambda: {101.0: 2.0})
+    assert geometry.get_assessment_area_states(101, buffer=buffer) == (
+        ['aa', 'bb'] if buffer else ['aa']
+    )
+
+
+def test_get_supersections_reprojection_is_memoized(supersections):
+    albers = geometry.get_supersections(crs='epsg:5070')
+    assert albers.crs.to_epsg() == 5070
+    assert geometry.get_supersections(crs='EPSG:5070') is albers
+    assert geometry.get_supersections(crs=albers.crs) is albers
+    assert geometry.get_supersections() is supersections
+
+    states = geometry.get_states(crs='epsg:5070')
+    assert geometry.get_states(crs=states.crs) is states
+
+
+def test_get_prepared_supersection(supersections):
+    geom = geometry.get_prepared_supersection(6.0)
+    assert shapely.is_prepared(geom)
+    assert geom.equals(supersections.loc[supersections['ss_id'] == 6.0].geometry.item())
+    assert geometry.get_prepared_supersection(6.0) is geom
+
+    points = shapely.points([1.5, 0.5], [2.5, 0.5])
+    assert shapely.contains(geom, points).tolist() == [True, False]
+
+
+@pytest.fixture
+def geometry_server(monkeypatch):
+    shapes = {
+        f'ACR{i}': geopandas.GeoDataFrame(geometry=[box(i, 0, i + 1, 1)], crs='epsg:4326').to_json()
+        for i in range(10)
+    }
+    requests_seen = []
+    in_flight = {'current': 0, 'peak': 0}
+    lock = threading.Lock()
+    overlapped = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            opr_id = self.path.split('/')[1]
+            body = shapes[opr_id].encode()
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            requests_seen.append((opr_id, self.headers.get('If-None-Match')))
+            with lock:
+                in_flight['current'] += 1
+                in_flight['peak'] = max(in_flight['peak'], in_flight['current'])
+                if in_flight['current'] > 1:
+                    overlapped.set()
+            # hold each request until a second one is in flight; serial requests time out instead
+            overlapped.wait(timeout=5)
+            with lock:
+                in_flight['current'] -= 1
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    class Source:
+        def __init__(self, opr_id):
+            self.urlpath = f'http://127.0.0.1:{server.server_port}/{opr_id}/shape.json'
+
+    class Catalog:
+        def arb_geometries(self, opr_id):
+            return Source(opr_id)
+
+    monkeypatch.setattr(geometry, 'cat', Catalog())
+    yield shapes, requests_seen, in_flight
+    server.shutdown()
+
+
+def test_load_project_geometries(geometry_server, local_cache_dir):
+    shapes, requests_seen, in_flight = geometry_server
+
+    geometries = geometry.load_project_geometries(list(shapes), max_workers=10)
+    assert in_flight['peak'] > 1
+
+    assert list(geometries) == list(shapes)
+    assert geometries['ACR3'].geometry.item().equals(box(3, 0, 4, 1))
+    assert all(etag is None for _, etag in requests_seen)
+
+    # unchanged geometries are revalidated (304) and read from the content-addressed cache
+    shapes['ACR3'] = geopandas.GeoDataFrame(geometry=[box(0, 0, 5, 5)], crs='epsg:4326').to_json()
+    requests_seen.clear()
+    geometries = geometry.load_project_geometries(list(shapes), max_workers=10)
+    assert all(etag is not None for _, etag in requests_seen)
+    assert geometries['ACR3'].geometry.item().equals(box(0, 0, 5, 5))
+    assert geometries['ACR4'].geometry.item().equals(box(4, 0, 5, 1))
+
+    cache_dir = local_cache_dir / geometry.PROJECT_GEOMETRY_CACHE_DIR
+    index = json.loads((cache_dir / 'index.json').read_text())
+    assert len(index) == 10
+    assert len(list((cache_dir / 'objects').glob('*.json'))) == 11
@@ -1,4 +1,11 @@
+import numpy as np
+import pandas as pd
+import pytest
+from intake_parquet import ParquetSource
+
+from carbonplan_forest_offsets.load import fia
 from carbonplan_forest_offsets.load.issuance import get_arb_id_map, load_issuance_table
+from carbonplan_forest_offsets.utils import apply_filters, compact_dtypes
 
 
 def test_load_issuance_table():
@@ -10,3 +17,194 @@ def test_load_issuance_table():
 def test_get_arb_id_map():
     arb_id_map = get_arb_id_map()
     assert isinstance(arb_id_map, dict)
+
+
+def test_apply_filters():
+    df = pd.DataFrame({'OWNCD': [46, 46, 11], 'MEASYEAR': [2001, 2005, 2005]})
+    filtered = apply_filters(df, [('OWNCD', '==', 46), ('MEASYEAR', '>', 2001)])
+    assert filtered.index.tolist() == [1]
+    assert apply_filters(df, None) is df
+
+    with pytest.raises(KeyError, match='MEASYR'):
+        apply_filters(df, [('OWNCD', '==', 46), ('MEASYR', '>', 2001)])
+
+
+def test_load_fia_state_long_filters(monkeypatch, tmp_path):
+    rng = np.random.default_rng(0)
+    n = 100
+    df = pd.DataFrame(
+        {
+            'adj_ag_biomass': rng.uniform(0, 100, n),
+            'OWNCD': rng.choice([11, 46], n),
+            'MEASYEAR': rng.integers(1995, 2020, n),
+            'LAT': rng.uniform(30, 40, n),
+            'LON': rng.uniform(-120, -110, n),
+        }
+    )
+    for column in [
+        'CONDID',
+        'STDAGE',
+        'SITECLCD',
+        'FORTYPCD',
+        'FLDTYPCD',
+        'ECOSUBCD',
+        'CONDPROP_UNADJ',
+        'COND_STATUS_CD',
+        'SLOPE',
+        'ASPECT',
+        'INVYR',
+        'ELEV',
+    ]:
+        df[column] = 1
+    fn = tmp_path / 'xx.parquet'
+    df.to_parquet(fn, row_group_size=10)
+
+    class Catalog:
+        def fia_long(self, postal_code, **kwargs):
+            return ParquetSource(str(fn), **kwargs)
+
+    monkeypatch.setattr(fia, 'cat', Catalog())
+
+    filters = (('MEASYEAR', '>', 2001), ('MEASYEAR', '<=', 2013))
+    loaded = fia.load_fia_state_long('xx', geometry=False, filters=filters)
+    expected = df[(df['OWNCD'] == 46) & (df['MEASYEAR'] > 2001) & (df['MEASYEAR'] <= 2013)]
+    assert sorted(loaded['adj_ag_biomass']) == pytest.approx(sorted(expected['adj_ag_biomass']))
+    fia.load_fia_state_long.cache_clear()
+
+
+def test_load_fia_common_practice_concurrent(monkeypatch):
+    def load_fia_state_long(postal_code, **kwargs):
+        return pd.DataFrame({'state': [postal_code] * 3, 'LAT': 35.0, 'LON': -110.0})
+
+    monkeypatch.setattr(fia, 'load_fia_state_long', load_fia_state_long)
+
+    postal_codes = ['az', 'nm', 'ut', 'co']
+    df = fia.load_fia_common_practice(postal_codes, geometry=False, max_workers=2)
+    assert df['state'].tolist() == [s for s in postal_codes for _ in range(3)]
+    assert df.index.tolist() == list(range(12))
+
+    with pytest.raises(ValueError):
+        fia.load_fia_common_practice(postal_codes, pool='fork')
+
+
+def test_load_fia_common_practice_compact_nbytes_saved(monkeypatch):
+    def load_fia_state_long(postal_code, compact=False, **kwargs):
+        rng = np.random.default_rng(len(postal_code))
+        n = 10_000
+        df = pd.DataFrame(
+            {
+                'OWNCD': 46,
+                'FORTYPCD': rng.choice([221, 801], n),
+                'ECOSUBCD': rng.choice([f'{postal_code}-{i}' for i in range(5)], n),
+                'slag_co2e_acre': rng.uniform(0, 100, n),
+                'LAT': rng.uniform(30, 40, n),
+                'LON': rng.uniform(-120, -110, n),
+            },
+            index=rng.permutation(n),
+        )
+        df['postal_code'] = postal_code
+        return compact_dtypes(df) if compact else df
+
+    monkeypatch.setattr(fia, 'load_fia_state_long', load_fia_state_long)
+
+    full = fia.load_fia_common_practice(['ca', 'ore'], geometry=False)
+    compact = fia.load_fia_common_practice(['ca', 'ore'], geometry=False, compact=True)
+    saved = full.memory_usage(deep=True).sum() - compact.memory_usage(deep=True).sum()
+    # string buffers are not exactly additive under concat, hence the (small) tolerance
+    assert compact.attrs['nbytes_saved'] == pytest.approx(saved, rel=1e-2)
+
+
+def test_split_regional_biomass(tmp_path):
+    df = pd.DataFrame(
+        {
+            'TRE_CN': np.arange(10),
+            'STATECD': [2, 6, 41, 53, 2, 2, 17, 6, 2, 53],
+            'REGIONAL_DRYBIOT': np.linspace(0, 1, 10),
+            'OTHER': 'x',
+        }
+    )
+    urlpath = tmp_path / 'TREE_REGIONAL_BIOMASS.csv'
+    df.to_csv(urlpath, index=False)
+
+    path = fia.split_regional_biomass(urlpath=str(urlpath), path=tmp_path / 'split', chunksize=3)
+    assert sorted(p.name for p in path.iterdir()) == [
+        'STATECD=17',
+        'STATECD=2',
+        'STATECD=41',
+        'STATECD=53',
+        'STATECD=6',
+    ]
+
+    ak = fia.load_regional_biomass('ak', path=path).sort_values('TRE_CN', ignore_index=True)
+    expected = df.loc[df['STATECD'] == 2, ['TRE_CN', 'REGIONAL_DRYBIOT']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(ak, expected)
+
+
+@pytest.fixture
+def fia_tables(monkeypatch, tmp_path):
+    rng = np.random.default_rng(0)
+    n_plots, n_trees = 20, 200
+    plots = pd.DataFrame(
+        {
+            'CN': np.arange(n_plots),
+            'LAT': rng.uniform(30, 40, n_plots),
+            'LON': rng.uniform(-120, -110, n_plots),
+            'ELEV': rng.uniform(0, 3000, n_plots),
+            'INVYR': rng.integers(2000, 2020, n_plots),
+        }
+    )
+    conds = pd.DataFrame(
+        {
+            'CN': np.arange(2 * n_plots) + 1000,
+            'PLT_CN': np.repeat(np.arange(n_plots), 2),
+            'CONDID': np.tile([1, 2], n_plots),
+            'OWNCD': rng.choice([11, 46], 2 * n_plots),
+            'FORTYPCD': rng.choice([221, 801], 2 * n_plots),
+            'FLDTYPCD': rng.choice([221, 801], 2 * n_plots),
+        }
+    )
+    trees = pd.DataFrame(
+        {
+            'CN': np.arange(n_trees) + 10_000,
+            'PLT_CN': rng.integers(0, n_plots + 2, n_trees),  # some trees without a plot
+            'TPA_UNADJ': rng.uniform(1, 10, n_trees),
+            'SPCD': rng.choice([122, 202, 802], n_trees),
+            'STATUSCD': rng.choice([1, 2], n_trees),
+            'DIA': rng.uniform(1, 30, n_trees),
+            'CARBON_AG': rng.uniform(0, 500, n_trees),
+            'CONDID': rng.choice([1, 2], n_trees),
+        }
+    )
+    tables = {'plot': plots, 'cond': conds, 'tree': trees}
+    for table, df in tables.items():
+        df.to_parquet(tmp_path / f'{table}.parquet', row_group_size=50)
+
+    requested = []
+
+    class Catalog:
+        def fia(self, postal_code, table, **kwargs):
+            requested.append(table)
+            return ParquetSource(str(tmp_path / f'{table}.parquet'), **kwargs)
+
+    monkeypatch.setattr(fia, 'cat', Catalog())
+    return requested
+
+
+def test_load_fia_tree_ddf_matches_load_fia_tree(fia_tables):
+    expected = fia.load_fia_tree('xx', geometry=False)
+    ddf = fia.load_fia_tree_ddf(['xx'])
+    actual = ddf.compute()
+
+    assert sorted(actual.columns) == sorted(expected.columns)
+    expected = expected.sort_values('CN', ignore_index=True)
+    actual = actual.sort_values('CN', ignore_index=True)[expected.columns]
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_load_fia_tree_ddf_columns(fia_tables):
+    ddf = fia.load_fia_tree_ddf(['xx', 'yy'], columns=['PLT_CN', 'SPCD', 'unadj_basal_area'])
+    assert 'cond' not in fia_tables
+
+    df = ddf.compute()
+    assert df.columns.tolist() == ['PLT_CN', 'SPCD', 'unadj_basal_area']
+    assert len(df) == 2 * len(fia.load_fia_tree('xx', geometry=False))
@@ -0,0 +1,81 @@
+import importlib.util
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SCRIPT = (
+    pathlib.Path(__file__).parents[1] / 'scripts' / 'preprocess' / 'patch_fia_regional_biomass.py'
+)
+
+
+@pytest.fixture
+def patcher():
+    spec = importlib.util.spec_from_file_location('patch_fia_regional_biomass', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    n = 12
+    tree = pd.DataFrame(
+        {
+            'CN': np.arange(n),
+            # all NaN in the first chunks, strings later
+            'REMARKS': [np.nan] * 8 + ['a', 'b', np.nan, 'c'],
+            # int in the first chunks, picks up NaNs later
+            'HTCD': pd.array([1, 2, 3, 4, 1, 2, 3, 4, None, 1, 2, None], dtype='Int64'),
+            'DIA': np.linspace(1, 20, n),
+            'DRYBIO_BOLE': 1.0,
+            'DRYBIO_TOP': 1.0,
+            'DRYBIO_SAPLING': 1.0,
+            'DRYBIO_WDLD_SPP': 1.0,
+        }
+    )
+    tree.to_csv(tmp_path / 'XX_TREE.csv', index=False)
+    regional = pd.DataFrame({'TRE_CN': np.arange(0, n, 2), 'REGIONAL_DRYBIOT': 10.0})
+    regional.to_csv(tmp_path / 'XX_TREE_REGIONAL_BIOMASS.csv', index=False)
+    return tmp_path
+
+
+def test_chunked_csv_patch_matches_unchunked(patcher, input_dir):
+    out_path = patcher.patch_tree_with_regional_biomass('XX', input_dir, chunksize=10**6)
+    expected = out_path.read_text()
+
+    patcher.patch_tree_with_regional_biomass('XX', input_dir, chunksize=3)
+    assert out_path.read_text() == expected
+    assert '\n0,,1.0,' in expected  # HTCD picks up NaNs, so it is float in every chunk
+
+
+def test_chunked_parquet_patch_matches_unchunked(patcher, input_dir):
+    out_path = patcher.patch_tree_with_regional_biomass(
+        'XX', input_dir, chunksize=10**6, output_format='parquet'
+    )
+    expected = pd.read_parquet(out_path)
+
+    patcher.patch_tree_with_regional_biomass('XX', input_dir, chunksize=3, output_format='parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(out_path), expected)
+    assert expected['REMARKS'].dropna().tolist() == ['a', 'b', 'c']
+    assert expected['DRYBIO_BOLE'].isna().sum() == 6
+
+
+def test_failed_patch_removes_tmp_file(patcher, input_dir, monkeypatch):
+    calls = []
+
+    def patch_chunk(tree, regional_drybiot):
+        calls.append(len(tree))
+        if len(calls) == 2:
+            raise ValueError('bad chunk')
+        return tree
+
+    monkeypatch.setattr(patcher, 'patch_chunk', patch_chunk)
+    with pytest.raises(ValueError):
+        patcher.patch_tree_with_regional_biomass(
+            'XX', input_dir, chunksize=3, output_format='parquet'
+        )
+
+    assert not list(input_dir.glob('*.tmp'))
+    assert not (input_dir / 'XX_TREE.parquet').exists()
@@ -0,0 +1,169 @@
+import dask.array
+import geopandas
+import numpy as np
+import pandas as pd
+import pyproj
+import pytest
+import rioxarray  # noqa: F401
+import shapely
+import xarray as xr
+from shapely.geometry import box
+from sklearn.neighbors import KDTree
+
+from carbonplan_forest_offsets.arbitrage import prism_arbitrage, runner
+from carbonplan_forest_offsets.arbitrage.prism_arbitrage import (
+    get_gridded_neighbor_mean,
+    get_neighbor_mean,
+)
+
+
+@pytest.mark.parametrize('chunksize', [1, 7, 1_000])
+def test_get_neighbor_mean_matches_loop(chunksize):
+    rng = np.random.default_rng(0)
+    fia_clim = pd.DataFrame(
+        {
+            'tmean_q': rng.uniform(size=500),
+            'ppt_q': rng.uniform(size=500),
+            'slag_co2e_acre': rng.uniform(0, 100, 500),
+        }
+    )
+    mesh_sample_points = rng.uniform(size=(50, 2))
+    tree = KDTree(fia_clim[['tmean_q', 'ppt_q']].values)
+
+    fia_idx = tree.query(mesh_sample_points, k=50, return_distance=False)
+    expected = [fia_clim.loc[idx, 'slag_co2e_acre'].mean() for idx in fia_idx]
+
+    actual = get_neighbor_mean(
+        tree, mesh_sample_points, fia_clim['slag_co2e_acre'].values, k=50, chunksize=chunksize
+    )
+    np.testing.assert_allclose(actual, expected)
+
+
+def test_get_gridded_neighbor_mean():
+    rng = np.random.default_rng(0)
+    fia_points = rng.uniform(size=(2_000, 2))
+    slag = 100 * fia_points[:, 0] + 20 * fia_points[:, 1]  # smooth in climate space
+    tree = KDTree(fia_points)
+    pixels = rng.uniform(size=(5_000, 2))
+
+    exact = get_neighbor_mean(tree, pixels, slag, k=200)
+    approx, error = get_gridded_neighbor_mean(tree, pixels, slag, k=200, resolution=51, n_check=500)
+
+    assert approx.shape == exact.shape
+    assert error['max_abs_error'] >= error['mean_abs_error'] > 0
+    assert np.abs(approx - exact).max() < 2
+    assert error['max_abs_error'] <= np.abs(approx - exact).max()
+
+
+@pytest.fixture
+def prism_catalog(monkeypatch):
+    x = 1000.0 * np.arange(100) + 500
+    y = 1000.0 * np.arange(80)[::-1] + 500
+
+    class Source:
+        def __init__(self, var, chunks=None):
+            self.offset = ['tmean', 'ppt'].index(var)
+            self.chunks = chunks
+
+        def to_dask(self):
+            data = dask.array.arange(80 * 100, dtype='f4').reshape(1, 80, 100) + self.offset
+            da = xr.DataArray(
+                data.rechunk((1, self.chunks['y'], self.chunks['x'])),
+                coords={'band': [1], 'y': y, 'x': x},
+                dims=('band', 'y', 'x'),
+            ).rio.write_crs('epsg:5070')
+            da.attrs['crs'] = da.rio.crs.to_wkt()
+            return da
+
+    class Catalog:
+        def prism(self, region, var, chunks=None):
+            return Source(var, chunks=chunks)
+
+    monkeypatch.setattr(prism_arbitrage, 'cat', Catalog())
+    prism_arbitrage.load_prism.cache_clear()
+    prism_arbitrage.load_prism_window.cache_clear()
+    yield
+    prism_arbitrage.load_prism.cache_clear()
+    prism_arbitrage.load_prism_window.cache_clear()
+
+
+def test_load_prism_is_lazy(prism_catalog):
+    tmean = prism_arbitrage.load_prism('conus', 'tmean')
+    assert isinstance(tmean.data, dask.array.Array)
+    assert tmean.name == 'tmean'
+    assert tmean.dims == ('y', 'x')
+
+
+def test_load_prism_window(prism_catalog):
+    window = prism_arbitrage.load_prism_window('conus', (10_000, 20_000, 30_000, 25_000))
+    assert sorted(window.data_vars) == ['ppt', 'tmean']
+    assert window['tmean'].shape == (7, 22)
+    assert window['x'].min() == 9_500 and window['y'].max() == 25_500
+    assert not isinstance(window['tmean'].data, dask.array.Array)
+    np.testing.assert_array_equal(window['ppt'].values, window['tmean'].values + 1)
+
+
+@pytest.fixture
+def arbitrage_inputs(prism_catalog, monkeypatch):
+    crs = prism_arbitrage.load_prism('conus', 'tmean').crs
+    supersections = geopandas.GeoDataFrame(
+        {'ss_id': [1, 2]},
+        geometry=[box(10_000, 10_000, 40_000, 30_000), box(50_000, 40_000, 90_000, 70_000)],
+        crs=crs,
+    )
+    states = {1: ['ca'], 2: ['ca', 'or']}
+    to_lonlat = pyproj.Transformer.from_crs(crs, 'epsg:4326', always_xy=True)
+    loaded = []
+
+    def load_fia_common_practice(postal_codes, geometry=True, filters=None):
+        loaded.append(list(postal_codes))
+        plots = []
+        for postal_code in postal_codes:
+            rng = np.random.default_rng(['ca', 'or'].index(postal_code))
+            lon, lat = to_lonlat.transform(
+                rng.uniform(0, 100_000, 200), rng.uniform(0, 80_000, 200)
+            )
+            plots.append(
+                pd.DataFrame({'LON': lon, 'LAT': lat, 'slag_co2e_acre': rng.uniform(0, 100, 200)})
+            )
+        return pd.concat(plots)
+
+    def get_prepared_supersection(supersection_id, crs=None):
+        geom = supersections.loc[supersections['ss_id'] == supersection_id].geometry.item()
+        shapely.prepare(geom)
+        return geom
+
+    monkeypatch.setattr(prism_arbitrage, 'get_supersections', lambda crs: supersections)
+    monkeypatch.setattr(
+        prism_arbitrage, 'get_region_and_states', lambda ss_id: ('conus', states[ss_id])
+    )
+    monkeypatch.setattr(prism_arbitrage, 'load_fia_common_practice', load_fia_common_practice)
+    monkeypatch.setattr(prism_arbitrage, 'get_prepared_supersection', get_prepared_supersection)
+    return loaded
+
+
+def test_warm_prism_arbitrage_inputs(arbitrage_inputs):
+    prism_arbitrage.warm_prism_arbitrage_inputs([1, 2])
+
+    # only the supersections' windows are read, the full grids stay lazy
+    assert isinstance(prism_arbitrage.load_prism('conus', 'tmean').data, dask.array.Array)
+    assert prism_arbitrage.load_prism_window.cache_info().misses == 2
+    # FIA conditions are read state by state
+    assert arbitrage_inputs == [['ca'], ['or']]
+
+    prism_arbitrage.get_prism_arbitrage_map(2)
+    assert prism_arbitrage.load_prism_window.cache_info().hits == 1
+
+
+def test_run_prism_arbitrage_maps(arbitrage_inputs, monkeypatch, tmp_path):
+    monkeypatch.setattr(runner, 'get_retro_bucket', lambda: (str(tmp_path), {}))
+
+    written = runner.run_supersections('map', [1, 2], backend='process', max_workers=2)
+
+    assert sorted(written) == [1, 2]
+    for ss_id in [1, 2]:
+        expected = prism_arbitrage.get_prism_arbitrage_map(ss_id).to_crs('epsg:4326')
+        actual = geopandas.read_file(written[ss_id])
+        assert len(actual) == len(expected) == {1: 30 * 20, 2: 40 * 30}[ss_id]
+        np.testing.assert_allclose(actual['delta_slag'], expected['delta_slag'])
+        assert np.isfinite(actual['relative_slag']).all()
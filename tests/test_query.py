@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbonplan_forest_offsets.analysis import rfia
+from carbonplan_forest_offsets.analysis.assign_project_fldtypcd import (
+    fractional_basal_area_by_species,
+)
+from carbonplan_forest_offsets.load import query
+
+pytest.importorskip('duckdb')
+
+
+@pytest.fixture
+def con(monkeypatch, tmp_path):
+    rng = np.random.default_rng(0)
+    for postal_code in ['xx', 'yy']:
+        n = 100
+        pd.DataFrame(
+            {
+                'CN': np.arange(n),
+                'PLT_CN': rng.integers(0, 10, n),
+                'CONDID': rng.choice([1, 2], n),
+                'SPCD': rng.choice([122, 202, 802], n),
+                'STATUSCD': rng.choice([1, 2], n),
+                'DIA': rng.uniform(1, 30, n),
+                'TPA_UNADJ': rng.uniform(1, 10, n),
+            }
+        ).to_parquet(tmp_path / f'tree_{postal_code}.parquet')
+        pd.DataFrame(
+            {
+                'adj_ag_biomass': np.where(
+                    rng.uniform(size=n) < 0.1, np.nan, rng.uniform(0, 100, n)
+                ),
+                'OWNCD': rng.choice([11, 46], n),
+                'LAT': rng.uniform(30, 40, n),
+                'LON': rng.uniform(-120, -110, n),
+            }
+        ).to_parquet(tmp_path / f'long_{postal_code}.parquet')
+
+    def get_catalog_urlpath(name, postal_code, table='long'):
+        return str(tmp_path / f'{table}_{postal_code}.parquet'), {}
+
+    monkeypatch.setattr(query, 'get_catalog_urlpath', get_catalog_urlpath)
+    return query.get_connection(threads=2)
+
+
+def test_query_basal_area_fractions(con, tmp_path):
+    query.register_fia(con, ['xx'], tables=['tree'])
+    fractions = query.query_basal_area_fractions(con)
+
+    trees = pd.read_parquet(tmp_path / 'tree_xx.parquet')
+    trees = trees[trees['STATUSCD'] == 1]
+    trees['unadj_basal_area'] = np.pi * (trees['DIA'] / (2 * 12)) ** 2 * trees['TPA_UNADJ']
+    for (plt_cn, condid), group in trees.groupby(['PLT_CN', 'CONDID']):
+        expected = fractional_basal_area_by_species(group)
+        actual = fractions[(fractions['PLT_CN'] == plt_cn) & (fractions['CONDID'] == condid)]
+        assert dict(zip(actual['SPCD'].astype(str), actual['fraction_species'])) == pytest.approx(
+            expected
+        )
+
+
+def test_query_slag_per_condition(con, tmp_path):
+    query.register_fia_long(con, ['xx', 'yy'])
+    slag = query.query_slag_per_condition(con)
+
+    expected = pd.concat(
+        [pd.read_parquet(tmp_path / f'long_{postal_code}.parquet') for postal_code in ['xx', 'yy']]
+    )
+    expected = expected[expected['OWNCD'] == 46].dropna()
+    assert sorted(slag['postal_code'].unique()) == ['xx', 'yy']
+    np.testing.assert_allclose(
+        np.sort(slag['slag_co2e_acre']),
+        np.sort(expected['adj_ag_biomass'] * (44 / 12) * (1 / 2.47) * 0.5),
+    )
+
+
+def test_query_cp_by_inventory_year(con, tmp_path):
+    records = []
+    for site in ['all', 'high']:
+        for year in [2009, 2010, 2011]:
+            for fortypcd, carb_total in [(101, 50.0), (102, 150.0)]:
+                records.append(
+                    {'YEAR': year, 'FORTYPCD': fortypcd, 'site': site, 'CARB_TOTAL': carb_total}
+                )
+    data = pd.DataFrame(records).assign(AREA_TOTAL=10.0, assessment_area_id=1)
+    path = rfia.write_rfia_store(data, path=tmp_path / 'rfia_store')
+
+    query.register_rfia(con, path=path)
+    cp = query.query_cp_by_inventory_year(con, assessment_area_ids=[1])
+    assert cp['YEAR'].tolist() == [2010, 2011]
+
+    expected = rfia.get_rfia_slag_co2e_acre(data[(data['site'] == 'all') & (data['YEAR'] == 2010)])
+    np.testing.assert_allclose(cp['common_practice'], expected)
@@ -0,0 +1,32 @@
+import numpy as np
+from scipy import sparse
+from sklearn.model_selection import GridSearchCV
+from sklearn.neighbors import RadiusNeighborsClassifier
+
+from carbonplan_forest_offsets.analysis.regional_classifier import prepare_regional_classifier
+
+
+def test_prepare_regional_classifier_matches_grid_search():
+    rng = np.random.default_rng(0)
+    n = 300
+    y = rng.choice([101, 102, 103], n)
+    X = rng.dirichlet(np.ones(6), n)
+    X[:, 0] += (y == 101) * 0.3
+    X[:, 1] += (y == 102) * 0.3
+    X[:10] = X[10:20]  # exact duplicates exercise zero-distance weighting
+    X = sparse.csr_matrix(X.round(2))
+    radii = np.arange(0.05, 0.4, 0.05)
+
+    result = prepare_regional_classifier({'features': X, 'targets': y}, radii=radii)
+
+    grid = GridSearchCV(
+        RadiusNeighborsClassifier(weights='distance', algorithm='brute', outlier_label=-999),
+        [{'radius': radii}],
+        cv=5,
+    ).fit(X, y)
+
+    np.testing.assert_allclose(
+        result['cv_scores']['mean_test_score'].values, grid.cv_results_['mean_test_score']
+    )
+    assert result['radius'] == grid.best_params_['radius']
+    np.testing.assert_array_equal(result['classifier'].predict(X), grid.best_estimator_.predict(X))
@@ -0,0 +1,262 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbonplan_forest_offsets.analysis import project_crediting_error, rfia
+
+
+def make_rfia_data(assessment_area_id, site_class='all', carb_acre_var=0.0):
+    fortypcds = {1.0: [101, 102], 2.0: [103]}[assessment_area_id]
+    records = []
+    for year in [2010, 2011, 2012, 2013]:
+        for fortypcd in fortypcds:
+            carb_acre = fortypcd / 10 + year % 2010
+            records.append(
+                {
+                    'YEAR': year,
+                    'FORTYPCD': fortypcd,
+                    'site': site_class,
+                    'CARB_ACRE': carb_acre,
+                    'CARB_TOTAL': carb_acre * 100,
+                    'AREA_TOTAL': 100.0,
+                    'CARB_ACRE_VAR': carb_acre_var,
+                }
+            )
+    return pd.DataFrame(records)
+
+
+@pytest.fixture
+def no_variance_rfia(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(rfia, 'load_rfia_data', make_rfia_data)
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+    yield
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+
+
+def test_build_rfia_summary(no_variance_rfia, tmp_path):
+    summary = rfia.build_rfia_summary(supersection_ids=[1])
+    assert (tmp_path / rfia.RFIA_SUMMARY_FN).exists()
+    assert set(summary['site_class']) == {'all', 'low', 'high'}
+    assert not summary.duplicated(subset=rfia.RFIA_SUMMARY_INDEX).any()
+
+
+def test_build_rfia_summary_merges_partial_builds(no_variance_rfia, monkeypatch):
+    monkeypatch.setattr(rfia, 'aa_code_to_ss_code', lambda: {1.0: 1, 2.0: 2})
+    rfia.build_rfia_summary()
+    before = rfia.get_rfia_summary_arrays(1, 'all')['carb_total']
+
+    monkeypatch.setattr(
+        rfia,
+        'load_rfia_data',
+        lambda aa, site_class: make_rfia_data(aa, site_class).assign(
+            CARB_TOTAL=lambda df: df['CARB_TOTAL'] * 2
+        ),
+    )
+    rfia.build_rfia_summary(supersection_ids=[1])
+
+    summary = rfia.load_rfia_summary()
+    assert set(summary['ss_id']) == {1, 2}
+    assert not summary.duplicated(subset=rfia.RFIA_SUMMARY_INDEX).any()
+    # the in-process caches are cleared after a rebuild
+    np.testing.assert_allclose(rfia.get_rfia_summary_arrays(1, 'all')['carb_total'], 2 * before)
+
+
+def test_rfia_summary_lookup_errors(no_variance_rfia):
+    with pytest.raises(FileNotFoundError, match='build_rfia_summary'):
+        rfia.load_rfia_summary()
+
+    rfia.build_rfia_summary(supersection_ids=[1])
+    with pytest.raises(KeyError, match='supersection 3'):
+        rfia.get_fortyp_weighted_slag_co2e_acre(3, {101: 1.0}, 'all')
+
+
+def test_fortyp_weighted_slag(no_variance_rfia):
+    weights = {101: 0.5, 102: 0.25, 103: 0.25}
+    rfia.build_rfia_summary(supersection_ids=[1])
+
+    data = pd.concat([make_rfia_data(1.0), make_rfia_data(2.0)])
+    data['slag'] = data['CARB_TOTAL'] / data['AREA_TOTAL'] * 44 / 12 * 0.907185
+    per_year = (data['FORTYPCD'].map(weights) * data['slag']).groupby(data['YEAR']).sum()
+
+    slag = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all')
+    assert slag == pytest.approx(per_year.median())
+
+
+def test_fortyp_weighted_slag_samples_matches_point_estimate(no_variance_rfia):
+    weights = {101: 0.5, 102: 0.25, 103: 0.25}
+    rfia.build_rfia_summary(supersection_ids=[1])
+    expected = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all')
+    looped = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all', uncertainty=True)
+    samples = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all', uncertainty=True, n_obs=10)
+    repeated = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all', n_obs=3)
+
+    assert samples.shape == (10,)
+    np.testing.assert_allclose(samples, expected)
+    np.testing.assert_allclose(samples, looped)
+    np.testing.assert_allclose(repeated, [expected] * 3)
+
+
+def test_fortyp_weighted_slag_samples_missing_fortyps(no_variance_rfia):
+    weights = {101: 0.5, 999: 0.5}
+    rfia.build_rfia_summary(supersection_ids=[1])
+    samples = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all', uncertainty=True, n_obs=5)
+    assert np.isnan(samples).all()
+
+
+class FakeSource:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data.copy()
+
+
+class FakeRfiaCatalog:
+    def __init__(self, data):
+        self.data = data
+
+    def rfia_all(self, assessment_area_id):
+        return FakeSource(self.data.drop(columns='site'))
+
+    def rfia(self, assessment_area_id):
+        return FakeSource(self.data)
+
+
+def test_load_rfia_data_from_store(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    rfia.load_rfia_data.cache_clear()
+
+    data = make_rfia_data(1.0)
+    data = pd.concat(
+        [
+            data,
+            data.assign(site='high', YEAR=data['YEAR'] - 2),
+            data.assign(site='low', CARB_TOTAL=0),
+        ]
+    )
+    data['assessment_area_id'] = 1
+    for key in ['CARB_TOTAL_VAR', 'AREA_TOTAL_VAR', 'nPlots_TREE', 'nPlots_AREA']:
+        data[key] = 0
+    rfia.write_rfia_store(data, path=tmp_path / rfia.RFIA_STORE_DIR)
+
+    # only consulted when the store has no partition for an assessment area and site class
+    catalog_data = make_rfia_data(1.0, site_class='low').assign(CARB_TOTAL=5.0)
+    for key in ['CARB_TOTAL_VAR', 'AREA_TOTAL_VAR', 'nPlots_TREE', 'nPlots_AREA']:
+        catalog_data[key] = 0
+    monkeypatch.setattr(rfia, 'cat', FakeRfiaCatalog(catalog_data))
+
+    assert len(rfia.load_rfia_data(1, site_class='all')) == 8
+    assert len(rfia.load_rfia_data(1, site_class='high')) == 4  # pre-2010 inventories dropped
+    assert (rfia.load_rfia_data(1, site_class='all')['site'] == 'all').all()
+
+    # ingested, but no carbon: the (empty) store result is returned without reading the catalog
+    monkeypatch.setattr(rfia, 'cat', None)
+    low = rfia.load_rfia_data(1, site_class='low')
+    assert len(low) == 0
+    assert list(low.columns) == rfia.RFIA_KEYS
+
+    # not ingested, so the catalog is read
+    monkeypatch.setattr(rfia, 'cat', FakeRfiaCatalog(catalog_data))
+    rfia.write_rfia_store(data[data['site'] != 'low'], path=tmp_path / rfia.RFIA_STORE_DIR)
+    low = rfia.load_rfia_data(1, site_class='low')
+    assert len(low) == 8
+    assert (low['CARB_TOTAL'] == 5.0).all()
+    rfia.load_rfia_data.cache_clear()
+
+
+def test_fortyp_weighted_slag_samples_perturb_each_row(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    # both assessment areas report the same forest types, so rows overlap within each year
+    monkeypatch.setattr(
+        rfia,
+        'load_rfia_data',
+        lambda aa, site_class: make_rfia_data(1.0, site_class, carb_acre_var=aa / 4),
+    )
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+    rfia.build_rfia_summary(supersection_ids=[1])
+    monkeypatch.setattr(np.random, 'normal', lambda loc, scale, size: np.ones(size))
+
+    weights = {101: 0.5, 102: 0.5}
+    samples = rfia.get_fortyp_weighted_slag_co2e_acre(1, weights, 'all', uncertainty=True, n_obs=3)
+
+    data = pd.concat([make_rfia_data(1.0, carb_acre_var=aa / 4) for aa in [1.0, 2.0]])
+    slag = (data['CARB_ACRE'] + data['CARB_ACRE_VAR'] ** 0.5) * 44 / 12 * 0.907185
+    per_year = (data['FORTYPCD'].map(weights) * slag).groupby(data['YEAR']).sum()
+    np.testing.assert_allclose(samples, [per_year.median()] * 3)
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+
+
+def make_project(code=1):
+    return {
+        'opr_id': 'ACR189',
+        'acreage': 1_000,
+        'assessment_areas': [{'code': code, 'site_class': 'high', 'acreage': 1_000}],
+        'carbon': {'common_practice': {'value': 50}, 'initial_carbon_stock': {'value': 120}},
+        'arbocs': {'calculated': 10_000},
+        'baseline': {'ifm_1': 80_000, 'ifm_3': 5_000, 'ifm_7': 2_000, 'ifm_8': 1_000},
+        'rp_1': {
+            'ifm_1': 110_000,
+            'ifm_3': 6_000,
+            'ifm_7': 1_500,
+            'ifm_8': 900,
+            'confidence_deduction': 0.025,
+            'secondary_effects': -500,
+        },
+    }
+
+
+@pytest.fixture
+def variance_rfia(monkeypatch, tmp_path):
+    monkeypatch.setenv('FOREST_OFFSETS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(rfia, 'load_rfia_data', partial(make_rfia_data, carb_acre_var=0.25))
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+    rfia.build_rfia_summary(supersection_ids=[1])
+    yield
+    rfia.load_rfia_summary.cache_clear()
+    rfia.get_rfia_summary_arrays.cache_clear()
+
+
+def test_project_crediting_error_batched_matches_loop(variance_rfia):
+    fortyp_weights = {'(1, 1)': {'101': 0.5, '102': 0.5}}
+    n_obs = 2_000
+
+    np.random.seed(0)
+    batched = project_crediting_error.get_project_crediting_error(
+        make_project(), fortyp_weights, n_obs=n_obs
+    ).compute()
+    looped = project_crediting_error.get_project_crediting_error(
+        make_project(), fortyp_weights, n_obs=n_obs, batched=False
+    ).compute()
+
+    for key in ['alt_slag', 'alt_arbocs', 'delta_arbocs']:
+        assert len(batched[key]) == len(looped[key]) == n_obs
+        batched_values, looped_values = np.array(batched[key]), np.array(looped[key])
+        assert batched_values.std() > 0
+        stderr = looped_values.std() / n_obs**0.5
+        assert abs(batched_values.mean() - looped_values.mean()) < 4 * stderr
+        assert batched_values.std() == pytest.approx(looped_values.std(), rel=0.1)
+
+
+def test_project_crediting_error_batched_no_matching_assessment_areas(variance_rfia):
+    fortyp_weights = {'(1, 1)': {'101': 0.5, '102': 0.5}}
+    error = project_crediting_error.get_project_crediting_error_batched(
+        make_project(code=2), fortyp_weights, n_obs=5
+    )
+    assert error['alt_slag'] == [0.0] * 5
+    assert len(error['delta_arbocs']) == 5
+
+
+def test_ensure_rfia_summary(no_variance_rfia, monkeypatch):
+    monkeypatch.setattr(rfia, 'aa_code_to_ss_code', lambda: {1.0: 1, 2.0: 2})
+    assert rfia.ensure_rfia_summary([1]) == {1}
+    assert rfia.ensure_rfia_summary([1, 2.0]) == {2}
+    assert rfia.ensure_rfia_summary([1, 2]) == set()
+    assert set(rfia.load_rfia_summary()['ss_id']) == {1, 2}
@@ -0,0 +1,62 @@
+import geopandas
+import pytest
+from shapely.geometry import Point
+
+from carbonplan_forest_offsets.arbitrage import runner
+
+
+@pytest.fixture
+def fake_runner(monkeypatch, tmp_path):
+    built = []
+
+    def build_output(kind, supersection_id):
+        if supersection_id == 13:
+            raise ValueError('no plots')
+        built.append(supersection_id)
+        return geopandas.GeoDataFrame(
+            {'ss_id': [supersection_id]}, geometry=[Point(0, 0)], crs='epsg:4326'
+        )
+
+    monkeypatch.setattr(runner, 'get_retro_bucket', lambda: (str(tmp_path), {}))
+    monkeypatch.setattr(runner, 'build_output', build_output)
+    monkeypatch.setattr(runner, 'warm_inputs', lambda kind, ids: built.append(('warm', tuple(ids))))
+    return tmp_path, built
+
+
+@pytest.mark.parametrize('backend', ['process', 'dask'])
+def test_run_supersections_resumes(fake_runner, backend):
+    tmp_path, built = fake_runner
+    out_dir = tmp_path / 'arbitrage' / 'prism-supersections'
+    out_dir.mkdir(parents=True)
+    (out_dir / '2.json').write_text('{}')
+
+    written = runner.run_supersections('map', [1, 2, 4], backend=backend, max_workers=2)
+
+    assert sorted(written) == [1, 4]
+    assert sorted(fn.name for fn in out_dir.iterdir()) == ['1.json', '2.json', '4.json']
+    assert (out_dir / '2.json').read_text() == '{}'
+    assert geopandas.read_file(out_dir / '4.json')['ss_id'].tolist() == [4]
+    # inputs are read once, in this process, for the supersections left to build
+    assert built == [('warm', (1, 4))]
+
+    assert runner.run_supersections('map', [1, 2, 4], backend=backend, max_workers=2) == {}
+    assert runner.run_supersections('map', [2], max_workers=1, overwrite=True) == {
+        2: f'{tmp_path}/arbitrage/prism-supersections/2.json'
+    }
+
+
+def test_run_supersections_keeps_finished_outputs(fake_runner):
+    tmp_path, _ = fake_runner
+
+    with pytest.raises(RuntimeError, match='13'):
+        runner.run_supersections('mesh', [13, 15], max_workers=2)
+
+    out_dir = tmp_path / 'arbitrage' / 'base_meshes'
+    assert sorted(fn.name for fn in out_dir.iterdir()) == ['15.json']
+
+
+def test_default_supersections():
+    assert 286 in runner.get_default_supersections('map')
+    assert all(ss_id < 200 for ss_id in runner.get_default_supersections('mesh'))
+    with pytest.raises(ValueError):
+        runner.run_supersections('tiles')
@@ -0,0 +1,96 @@
+import geopandas
+import numpy as np
+import pandas as pd
+import pytest
+from affine import Affine
+from scipy.spatial import cKDTree
+from shapely.geometry import box
+
+from carbonplan_forest_offsets.utils import (
+    as_geodataframe,
+    clip_points,
+    compact_dtypes,
+    get_nearest_valid_cells,
+    to_geodataframe,
+)
+
+
+def make_plots(n=1_000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'LAT': rng.uniform(30, 40, n), 'LON': rng.uniform(-120, -110, n)})
+
+
+def test_to_geodataframe():
+    df = make_plots()
+    gdf = to_geodataframe(df)
+    assert gdf.crs == 'epsg:4326'
+    np.testing.assert_allclose(gdf.geometry.x, df['LON'])
+    np.testing.assert_allclose(gdf.geometry.y, df['LAT'])
+    assert as_geodataframe(gdf) is gdf
+
+
+def test_clip_points():
+    df = make_plots()
+    aoi = box(-118, 32, -115, 35).union(box(-112, 38, -111, 39))
+
+    clipped = clip_points(df, aoi)
+    expected = geopandas.clip(to_geodataframe(df), aoi)
+    assert sorted(clipped.index) == sorted(expected.index)
+
+
+def test_compact_dtypes():
+    n = 1000
+    df = pd.DataFrame(
+        {
+            'CN': np.arange(n, dtype=np.int64) + 10**14,
+            'OWNCD': np.full(n, 46.0),
+            'FORTYPCD': np.where(np.arange(n) % 10 == 0, np.nan, 221.0),
+            'SPCD': np.full(n, 802, dtype=np.int64),
+            'LAT': np.linspace(30, 40, n),
+            'slag_co2e_acre': np.linspace(0, 100, n),
+            'postal_code': 'ca',
+        }
+    )
+    compact = compact_dtypes(df)
+
+    assert compact['OWNCD'].dtype == np.int8
+    assert compact['SPCD'].dtype == np.int16
+    assert compact['FORTYPCD'].dtype == np.float32
+    assert compact['FORTYPCD'].isna().sum() == 100
+    assert compact['slag_co2e_acre'].dtype == np.float32
+    assert compact['postal_code'].dtype == 'category'
+    assert compact['CN'].dtype == np.int64
+    assert compact['LAT'].dtype == np.float64
+    assert (compact['OWNCD'] == 46).all()
+
+    saved = df.memory_usage(deep=True).sum() - compact.memory_usage(deep=True).sum()
+    assert compact.attrs['nbytes_saved'] == saved > 0
+    assert 'nbytes_saved' not in df.attrs
+
+
+@pytest.mark.parametrize('margin', [0, 8, 100])
+def test_get_nearest_valid_cells(margin):
+    rng = np.random.default_rng(0)
+    valid = rng.uniform(size=(40, 60)) > 0.7
+    transform = Affine(4000.0, 0, -2e6, 0, -4000.0, 3e6)  # 4 km cells, north up
+
+    # cell centers inside, and well outside, the raster
+    rows = rng.integers(-20, 60, 500)
+    cols = rng.integers(-20, 80, 500)
+    x = transform.c + (cols + 0.5) * transform.a
+    y = transform.f + (rows + 0.5) * transform.e
+
+    nearest_rows, nearest_cols = get_nearest_valid_cells(valid, transform, x, y, margin=margin)
+    assert valid[nearest_rows, nearest_cols].all()
+
+    inside = (rows >= 0) & (rows < 40) & (cols >= 0) & (cols < 60)
+    on_valid = inside.copy()
+    on_valid[inside] = valid[rows[inside], cols[inside]]
+    assert (nearest_rows[on_valid] == rows[on_valid]).all()
+    assert (nearest_cols[on_valid] == cols[on_valid]).all()
+
+    valid_rows, valid_cols = np.nonzero(valid)
+    distances, _ = cKDTree(np.stack([valid_rows, valid_cols], axis=1)).query(
+        np.stack([rows, cols], axis=1)
+    )
+    np.testing.assert_allclose(np.hypot(nearest_rows - rows, nearest_cols - cols), distances)